@@ -0,0 +1,89 @@
+import argparse
+
+from database import DB_PATH, connect
+from migrations import migrate
+
+# Агрегат -> (таблица, запрос для пересчета с нуля, число колонок ключа).
+# Таблицы агрегатов поддерживаются триггерами (см. migrations.py);
+# пересчет нужен только для проверки и восстановления после ручных правок базы.
+AGGREGATES = {
+    "WorkoutTypeStats": (
+        "SELECT workout_type, workout_count, total_minutes, total_calories FROM WorkoutTypeStats",
+        "SELECT workout_type, COUNT(*), IFNULL(SUM(duration_minutes), 0), IFNULL(SUM(calories_burned), 0) "
+        "FROM Workouts GROUP BY workout_type",
+        1,
+    ),
+    "WorkoutDailyStats": (
+        "SELECT day, workout_type, workout_count, total_minutes, total_calories FROM WorkoutDailyStats",
+        "SELECT CAST(date AS TEXT), workout_type, COUNT(*), IFNULL(SUM(duration_minutes), 0), IFNULL(SUM(calories_burned), 0) "
+        "FROM Workouts GROUP BY date, workout_type",
+        2,
+    ),
+    "ProgressDailyStats": (
+        "SELECT day, entries, weight_sum, weight_count, body_fat_sum, body_fat_count, muscle_mass_sum, muscle_mass_count "
+        "FROM ProgressDailyStats",
+        "SELECT CAST(date AS TEXT), COUNT(*), IFNULL(SUM(weight), 0), COUNT(weight), IFNULL(SUM(body_fat_percentage), 0), "
+        "COUNT(body_fat_percentage), IFNULL(SUM(muscle_mass), 0), COUNT(muscle_mass) FROM Progress GROUP BY date",
+        1,
+    ),
+}
+
+
+def _normalize(row):
+    # Суммы REAL, накопленные триггерами, могут отличаться от пересчета в последних знаках
+    return tuple(round(value, 6) if isinstance(value, float) else value for value in row)
+
+
+def find_drift(conn, name):
+    """Сравнить сохраненный агрегат с пересчитанным, вернуть список расхождений"""
+    stored_query, rebuild_query, key_size = AGGREGATES[name]
+    stored = {row[:key_size]: _normalize(row[key_size:]) for row in conn.execute(stored_query)}
+    expected = {row[:key_size]: _normalize(row[key_size:]) for row in conn.execute(rebuild_query)}
+    drift = []
+    for key in sorted(stored.keys() | expected.keys(), key=repr):
+        if stored.get(key) != expected.get(key):
+            drift.append((key, stored.get(key), expected.get(key)))
+    return drift
+
+
+def rebuild(conn, name):
+    """Пересчитать агрегат с нуля в одной транзакции"""
+    _, rebuild_query, _ = AGGREGATES[name]
+    with conn:
+        conn.execute(f"DELETE FROM {name}")
+        conn.execute(f"INSERT INTO {name} {rebuild_query}")
+
+
+def check(conn, repair=True):
+    """Проверить все агрегаты; при repair пересчитать те, что разошлись с данными"""
+    report = {}
+    for name in AGGREGATES:
+        drift = find_drift(conn, name)
+        if drift and repair:
+            rebuild(conn, name)
+        report[name] = drift
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Проверка и пересчет агрегатов статистики")
+    parser.add_argument("--dry-run", action="store_true", help="только показать расхождения, не пересчитывать")
+    args = parser.parse_args()
+
+    conn = connect(DB_PATH)
+    try:
+        migrate(conn)
+        report = check(conn, repair=not args.dry_run)
+    finally:
+        conn.close()
+
+    has_drift = False
+    for name, drift in report.items():
+        if not drift:
+            print(f"{name}: расхождений нет")
+            continue
+        has_drift = True
+        print(f"{name}: расхождений {len(drift)}{'' if args.dry_run else ', пересчитано'}")
+        for key, stored, expected in drift:
+            print(f"  {key}: сохранено {stored}, ожидалось {expected}")
+    raise SystemExit(1 if has_drift else 0)
@@ -0,0 +1,132 @@
+"""Нагрузочный тест: задержки p50/p99 синхронных и асинхронных обработчиков
+
+Поднимает локальный uvicorn дважды - с FITNESS_DB_ASYNC=0 (обработчики в пуле
+потоков FastAPI, как раньше) и с FITNESS_DB_ASYNC=1 (async def и свои потоки для базы) -
+и гоняет одинаковую смесь GET-запросов при разном числе одновременных клиентов.
+
+Запуск из корня проекта:
+    python -m benchmarks.async_benchmark --clients 1 50 500 --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ENDPOINTS = ["/workouts/?limit=20", "/exercises/", "/stats/workouts", "/workout-exercises/1", "/stats/progress"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seed(path, rows):
+    """Создать схему через приложение и заполнить базу тестовыми строками"""
+    subprocess.run(
+        [sys.executable, "-c", "import main"],
+        env={**os.environ, "FITNESS_DB": path},
+        check=True
+    )
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO Workouts (title, workout_type, duration_minutes, calories_burned, date, notes) VALUES (?, ?, ?, ?, ?, ?)",
+        [(f"Тренировка {i}", ("Силовая", "Кардио", "Йога")[i % 3], 30 + i % 60, 200 + i % 300, f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}", "")
+         for i in range(rows)]
+    )
+    conn.executemany(
+        "INSERT INTO Exercises (name, description, muscle_group) VALUES (?, ?, ?)",
+        [(f"Упражнение {i}", "", "Ноги") for i in range(20)]
+    )
+    conn.executemany(
+        "INSERT INTO WorkoutExercises (workout_id, exercise_id, sets, reps) VALUES (?, ?, ?, ?)",
+        [(1 + i % 50, 1 + i % 20, 3, 10) for i in range(200)]
+    )
+    conn.executemany(
+        "INSERT INTO Progress (date, weight, muscle_mass) VALUES (?, ?, ?)",
+        [(f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}", 70 + i % 10, 35 + i % 5) for i in range(rows // 10)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def start_server(path, port, async_mode):
+    env = {
+        **os.environ,
+        "FITNESS_DB": path,
+        "FITNESS_DB_ASYNC": "1" if async_mode else "0",
+        # Мерим путь до базы, а не попадания в кэш ответов
+        "FITNESS_CACHE_TTL": "0",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning", "--timeout-keep-alive", "60"],
+        env=env
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/stats/workouts")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Сервер не запустился")
+
+
+async def load(port, clients, total):
+    """total запросов от clients одновременных клиентов, вернуть список задержек в секундах"""
+    latencies = []
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        counter = iter(range(total))
+
+        async def worker():
+            for i in counter:
+                start = time.perf_counter()
+                response = await client.get(ENDPOINTS[i % len(ENDPOINTS)])
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    seed(path, args.rows)
+
+    print(f"{'режим':<8}{'клиентов':>10}{'запр/с':>10}{'p50, мс':>10}{'p99, мс':>10}")
+    for async_mode in (False, True):
+        port = free_port()
+        server = start_server(path, port, async_mode)
+        try:
+            for clients in args.clients:
+                latencies, elapsed = asyncio.run(load(port, clients, args.requests))
+                print(f"{'async' if async_mode else 'sync':<8}{clients:>10}{len(latencies) / elapsed:>10.0f}"
+                      f"{percentile(latencies, 0.5) * 1000:>10.1f}{percentile(latencies, 0.99) * 1000:>10.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    cli()
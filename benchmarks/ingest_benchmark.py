@@ -0,0 +1,125 @@
+"""Пропускная способность POST /workouts/: синхронная запись и очередь отложенной записи
+
+Поднимает локальный uvicorn дважды - с FITNESS_WRITE_BEHIND=0 (коммит и fsync на каждый
+запрос) и с FITNESS_WRITE_BEHIND=1 (строки пишутся пачками в одной транзакции) - в профиле
+хранения "durable" и создает одинаковое число тренировок. Для отложенной записи время
+считается до подтверждения последнего токена через GET /ingest/{token}, то есть до записи
+всех строк на диск, а не до ответа на POST.
+
+Отдельно мерится тот же путь записи без HTTP: коммит на каждую строку через писателя пула
+против IngestQueue. Выигрыш тем больше, чем дороже fsync на диске сервера.
+
+Запуск из корня проекта:
+    python -m benchmarks.ingest_benchmark --clients 50 --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.async_benchmark import free_port
+from database import ConnectionPool, current_pool
+from ingest import IngestQueue
+from migrations import migrate
+from repository import workout_repository
+
+WORKOUT = {"title": "Тренировка", "workout_type": "Кардио", "duration_minutes": 30, "date": "2024-01-15"}
+
+
+def start_server(path, port, write_behind):
+    env = {
+        **os.environ,
+        "FITNESS_DB": path,
+        "FITNESS_DB_PROFILE": "durable",
+        "FITNESS_WRITE_BEHIND": "1" if write_behind else "0",
+        "FITNESS_CACHE_TTL": "0",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning", "--timeout-keep-alive", "60"],
+        env=env
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/ingest/stats")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Сервер не запустился")
+
+
+async def load(port, clients, total):
+    """total POST-запросов от clients клиентов; секунд до записи последней строки"""
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        counter = iter(range(total))
+        tokens = []
+
+        async def worker():
+            for _ in counter:
+                response = await client.post("/workouts/", params=WORKOUT)
+                body = response.json()
+                if "error" in body:
+                    raise RuntimeError(body["error"])
+                if "token" in body:
+                    tokens.append(body["token"])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        if tokens:
+            while (await client.get(f"/ingest/{max(tokens)}")).json()["status"] == "pending":
+                await asyncio.sleep(0.001)
+        return time.perf_counter() - start
+
+
+def direct(total, write_behind):
+    """total строк без HTTP: по коммиту на строку или через очередь; строк в секунду"""
+    db = ConnectionPool(os.path.join(tempfile.mkdtemp(), "bench.db"), size=1, profile="durable")
+    with db.writer() as conn:
+        migrate(conn)
+    context = current_pool.set(db)
+    try:
+        start = time.perf_counter()
+        if write_behind:
+            ingest_queue = IngestQueue()
+            for _ in range(total):
+                ingest_queue.submit(workout_repository, WORKOUT)
+            ingest_queue.close()
+        else:
+            for _ in range(total):
+                with db.writer() as conn:
+                    workout_repository.create(conn, **WORKOUT)
+                    conn.commit()
+        return total / (time.perf_counter() - start)
+    finally:
+        current_pool.reset(context)
+        db.close()
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"{'режим':<14}{'HTTP, строк/с':>16}{'без HTTP, строк/с':>20}")
+    for write_behind in (False, True):
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        port = free_port()
+        server = start_server(path, port, write_behind)
+        try:
+            elapsed = asyncio.run(load(port, args.clients, args.requests))
+            print(f"{'write-behind' if write_behind else 'sync':<14}{args.requests / elapsed:>16.0f}"
+                  f"{direct(args.requests * 4, write_behind):>20.0f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,95 @@
+"""Сравнение пропускной способности: новое соединение на запрос против пула соединений
+
+Запуск из корня проекта:
+    python -m benchmarks.pool_benchmark --requests 2000 --threads 8
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# Бенчмарк работает на отдельной временной базе, чтобы не трогать fitness_tracker.db;
+# кэш ответов отключен, иначе оба варианта мерили бы в основном попадания в кэш
+os.environ.setdefault("FITNESS_DB", os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("FITNESS_CACHE_TTL", "0")
+
+from fastapi.testclient import TestClient
+
+import database
+import main
+from database import DB_PATH
+
+ENDPOINTS = ["/workouts/", "/exercises/", "/stats/workouts", "/stats/progress"]
+
+
+class OpenPerRequest(database.ConnectionPool):
+    """Старый путь: новое соединение на каждый запрос"""
+
+    def acquire(self):
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def release(self, conn):
+        conn.close()
+
+
+def seed(rows):
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany(
+        "INSERT INTO Workouts (title, workout_type, duration_minutes, calories_burned, date, notes) VALUES (?, ?, ?, ?, ?, ?)",
+        [(f"Тренировка {i}", "Силовая" if i % 2 else "Кардио", 30 + i % 60, 200 + i % 300, f"2024-01-{i % 28 + 1:02d}", "")
+         for i in range(rows)]
+    )
+    conn.executemany(
+        "INSERT INTO Exercises (name, description, muscle_group) VALUES (?, ?, ?)",
+        [(f"Упражнение {i}", "", "Ноги") for i in range(20)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(total, threads):
+    """Выполнить total запросов в threads потоках, вернуть запросов в секунду"""
+    per_thread = total // threads
+
+    def worker():
+        client = TestClient(main.app)
+        for i in range(per_thread):
+            client.get(ENDPOINTS[i % len(ENDPOINTS)])
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=50)
+    args = parser.parse_args()
+
+    seed(args.rows)
+
+    pooled_pool = database.pool
+    database.pool = OpenPerRequest(DB_PATH)
+    per_request = run(args.requests, args.threads)
+
+    database.pool = pooled_pool
+    pooled_pool.warm()
+    pooled = run(args.requests, args.threads)
+    pooled_pool.close()
+
+    print(f"Соединение на запрос: {per_request:8.1f} запросов/с")
+    print(f"Пул соединений:       {pooled:8.1f} запросов/с")
+    print(f"Ускорение:            {pooled / per_request:8.2f}x")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,94 @@
+"""Сравнение сериализации больших списков: словари по индексам + jsonable_encoder против rows_as_dicts + FastJSONResponse
+
+Для каждого варианта строки Workouts (уже выбранные из SQLite) превращаются
+в тело JSON-ответа. Считаются процессорное время (лучшее из --repeat прогонов)
+и пик памяти Python по tracemalloc.
+
+Запуск из корня проекта:
+    python -m benchmarks.serialization_benchmark --rows 100000
+"""
+import argparse
+import sqlite3
+import time
+import tracemalloc
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import serialization
+from migrations import migrate
+from serialization import FastJSONResponse, rows_as_dicts
+
+COLUMNS = ("workout_id", "title", "workout_type", "duration_minutes", "calories_burned", "date", "notes")
+
+
+def load_rows(rows):
+    conn = sqlite3.connect(":memory:")
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO Workouts (title, workout_type, duration_minutes, calories_burned, date, notes) VALUES (?, ?, ?, ?, ?, ?)",
+        [(f"Тренировка {i}", "Силовая" if i % 2 else "Кардио", 30 + i % 60, 200 + i % 300, f"2024-01-{i % 28 + 1:02d}", "Заметка")
+         for i in range(rows)]
+    )
+    result = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM Workouts ORDER BY workout_id").fetchall()
+    conn.close()
+    return result
+
+
+def encode_dicts(rows):
+    """Прежний путь: словарь по индексам в обработчике, jsonable_encoder FastAPI, json Starlette"""
+    content = [{
+        "workout_id": w[0],
+        "title": w[1],
+        "workout_type": w[2],
+        "duration_minutes": w[3],
+        "calories_burned": w[4],
+        "date": w[5],
+        "notes": w[6]
+    } for w in rows]
+    return JSONResponse(content=jsonable_encoder(content)).body
+
+
+def encode_fast(rows):
+    """Новый путь: готовый ответ из обработчика, jsonable_encoder не вызывается"""
+    return FastJSONResponse(content=rows_as_dicts(COLUMNS, rows)).body
+
+
+def measure(encode, rows, repeat):
+    """(лучшее процессорное время в секундах, пик памяти в байтах, размер тела)"""
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        body = encode(rows)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    encode(rows)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, len(body)
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = load_rows(args.rows)
+    variants = [
+        ("dict + jsonable_encoder", encode_dicts),
+        (f"rows_as_dicts + {'orjson' if serialization.orjson else 'json'}", encode_fast),
+    ]
+    results = []
+    for name, encode in variants:
+        seconds, peak, size = measure(encode, rows, args.repeat)
+        results.append((seconds, peak))
+        print(f"{name:28} {seconds * 1000:9.1f} мс CPU  {peak / 2**20:8.1f} МБ пик  {size / 2**20:6.1f} МБ тело")
+
+    (old_seconds, old_peak), (new_seconds, new_peak) = results
+    print(f"Ускорение: {old_seconds / new_seconds:.1f}x, пик памяти меньше в {old_peak / new_peak:.1f} раза")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,77 @@
+"""Пропускная способность записи в зависимости от числа баз пользователей (шардов)
+
+Одинаковое число одновременных клиентов создает тренировки через POST /workouts/;
+клиент i пишет от имени пользователя i % shards (заголовок X-User-Id). При одном
+шарде все записи ждут одну блокировку записи SQLite, при нескольких - идут параллельно.
+Профиль хранения по умолчанию "durable" (fsync на каждый коммит); число потоков
+записи - значение приложения по умолчанию при заданном FITNESS_SHARD_DIR.
+
+Запуск из корня проекта:
+    python -m benchmarks.shard_benchmark --clients 8 --requests 2000 --shards 1 2 4 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# Бенчмарк работает на временных базах; настройки читаются при импорте приложения, поэтому задаются до него
+_tmpdir = tempfile.mkdtemp()
+os.environ.setdefault("FITNESS_DB", os.path.join(_tmpdir, "main.db"))
+os.environ.setdefault("FITNESS_SHARD_DIR", _tmpdir)
+os.environ.setdefault("FITNESS_DB_PROFILE", "durable")
+os.environ.setdefault("FITNESS_CACHE_TTL", "0")
+
+import httpx
+
+import main
+from database import WRITE_THREADS
+from shards import shard_registry
+
+WORKOUT = {"title": "Тренировка", "workout_type": "Кардио", "duration_minutes": 30, "date": "2024-01-15"}
+
+
+async def load(shards, clients, total, run):
+    """total POST-запросов от clients клиентов, распределенных по shards пользователям; запросов в секунду"""
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        counter = iter(range(total))
+
+        async def worker(i):
+            headers = {"X-User-Id": f"run{run}-user{i % shards}"}
+            for _ in counter:
+                response = await client.post("/workouts/", params=WORKOUT, headers=headers)
+                response.raise_for_status()
+                if "error" in response.json():
+                    raise RuntimeError(response.json()["error"])
+
+        # Файлы пользователей создаются до замера
+        for i in range(shards):
+            shard_registry.open(f"run{run}-user{i}")
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(clients)))
+        return total / (time.perf_counter() - start)
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    if shard_registry is None:
+        sys.exit("FITNESS_SHARD_DIR не задан")
+    print(f"потоков записи: {WRITE_THREADS}")
+    print(f"{'шардов':>8}{'запр/с':>10}{'ускорение':>12}")
+    baseline = None
+    for run, shards in enumerate(args.shards):
+        rate = asyncio.run(load(shards, args.clients, args.requests, run))
+        baseline = baseline or rate
+        print(f"{shards:>8}{rate:>10.0f}{rate / baseline:>11.2f}x")
+    shard_registry.close()
+
+
+if __name__ == "__main__":
+    cli()
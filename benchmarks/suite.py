@@ -0,0 +1,312 @@
+"""Воспроизводимый нагрузочный прогон API без сети
+
+База заполняется строками из test_data.txt в заданном масштабе, затем смесь запросов
+из Fitness_tracker.postman_collection.json отправляется в приложение напрямую
+через ASGI (httpx.ASGITransport), без uvicorn и сокетов.
+
+Для каждого эндпоинта считаются пропускная способность, перцентили задержки
+и время SQL (метрика http_request_sql_duration_seconds из metrics.py). Результат сравнивается с сохраненным базовым прогоном:
+если эндпоинт стал медленнее больше допустимого, прогон завершается с кодом 1.
+
+Запуск из корня проекта:
+    python -m benchmarks.suite --rows 10000 --save-baseline
+    python -m benchmarks.suite --rows 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+TEST_DATA = ROOT / "test_data.txt"
+COLLECTION = ROOT / "Fitness_tracker.postman_collection.json"
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+# Доля запросов из каждой папки коллекции Postman
+MIXES = {
+    "read-heavy": {"GET": 90, "POST": 6, "PUT": 3, "DELETE": 1},
+    "mixed": {"GET": 60, "POST": 25, "PUT": 10, "DELETE": 5},
+    "write-heavy": {"GET": 20, "POST": 60, "PUT": 15, "DELETE": 5},
+}
+
+# Таблица test_data.txt, строки которой используются как параметры запроса
+REQUEST_TABLES = {
+    "workouts": "Workouts",
+    "exercises": "Exercises",
+    "progress": "Progress",
+    "workout-exercises": "WorkoutExercises",
+}
+
+# Какой id подставлять в переменную пути Postman
+PATH_VARIABLES = {
+    "workout_id": "Workouts",
+    "exercise_id": "Exercises",
+    "progress_id": "Progress",
+    "workout_exercise_id": "WorkoutExercises",
+}
+
+SEED_BATCH_SIZE = 10000
+
+# Эндпоинты с меньшим числом запросов в прогоне слишком шумят для сравнения
+MIN_SAMPLES = 50
+# Разница меньше этой величины (мс) считается шумом, даже если превышает допуск в процентах
+NOISE_FLOOR_MS = 1.0
+
+
+def load_test_data(path=TEST_DATA):
+    """Разобрать test_data.txt: таблица -> список строк-шаблонов"""
+    text = path.read_text(encoding="utf-8")
+    decoder = json.JSONDecoder()
+    tables = {}
+    for match in re.finditer(r"Таблица (\w+)", text):
+        start = text.index("[", match.end())
+        tables[match.group(1)], _ = decoder.raw_decode(text, start)
+    return tables
+
+
+def load_requests(app, path=COLLECTION):
+    """Достать из коллекции Postman шаблоны запросов и сопоставить их с маршрутами приложения"""
+    collection = json.loads(path.read_text(encoding="utf-8"))
+    routes = {}
+    for route in app.routes:
+        for method in getattr(route, "methods", ()):
+            routes[(method, route.path.rstrip("/"))] = route
+
+    requests = []
+    for folder in collection["item"]:
+        for item in folder["item"]:
+            request = item["request"]
+            parts = request["url"]["path"]
+            template = "/" + "/".join("{" + p[1:] + "}" if p.startswith(":") else p for p in parts if p)
+            route = routes.get((request["method"], template.rstrip("/")))
+            if route is None:
+                continue
+            requests.append({
+                "folder": folder["name"],
+                "method": request["method"],
+                "path": route.path,
+                "endpoint": route.endpoint.__name__,
+                "table": REQUEST_TABLES.get(parts[0]),
+            })
+    return requests
+
+
+def seed(path, rows, tables):
+    """Заполнить базу: rows тренировок, по 2 упражнения на тренировку, прогресс раз в 10 тренировок"""
+    conn = sqlite3.connect(path)
+    start = date(2015, 1, 1)
+
+    def day(i, total):
+        return (start + timedelta(days=i * 3650 // max(total, 1))).isoformat()
+
+    def insert(table, columns, count, make_row):
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        for offset in range(0, count, SEED_BATCH_SIZE):
+            conn.executemany(sql, (make_row(i) for i in range(offset, min(offset + SEED_BATCH_SIZE, count))))
+            conn.commit()
+
+    exercises = tables["Exercises"]
+    exercise_count = max(len(exercises), min(rows // 100, 1000))
+    insert("Exercises", ["name", "description", "muscle_group"], exercise_count,
+           lambda i: (f"{exercises[i % len(exercises)]['name']} {i}", exercises[i % len(exercises)].get("description"),
+                      exercises[i % len(exercises)].get("muscle_group")))
+
+    workouts = tables["Workouts"]
+    insert("Workouts", ["title", "workout_type", "duration_minutes", "calories_burned", "date", "notes"], rows,
+           lambda i: (workouts[i % len(workouts)]["title"], workouts[i % len(workouts)]["workout_type"],
+                      workouts[i % len(workouts)]["duration_minutes"], workouts[i % len(workouts)].get("calories_burned"),
+                      day(i, rows), workouts[i % len(workouts)].get("notes")))
+
+    links = tables["WorkoutExercises"]
+    insert("WorkoutExercises", ["workout_id", "exercise_id", "sets", "reps", "weight_kg", "duration_seconds"], rows * 2,
+           lambda i: (1 + i // 2, 1 + i % exercise_count, links[i % len(links)].get("sets"), links[i % len(links)].get("reps"),
+                      links[i % len(links)].get("weight_kg"), links[i % len(links)].get("duration_seconds")))
+
+    progress = tables["Progress"]
+    progress_count = max(rows // 10, 1)
+    insert("Progress", ["date", "weight", "height", "body_fat_percentage", "muscle_mass", "notes"], progress_count,
+           lambda i: (day(i, progress_count), progress[i % len(progress)].get("weight"), progress[i % len(progress)].get("height"),
+                      progress[i % len(progress)].get("body_fat_percentage"), progress[i % len(progress)].get("muscle_mass"),
+                      progress[i % len(progress)].get("notes")))
+
+    conn.execute("ANALYZE")
+    conn.close()
+    return {"Workouts": rows, "Exercises": exercise_count, "WorkoutExercises": rows * 2, "Progress": progress_count}
+
+
+def sql_totals(registry, requests):
+    """Суммарное время SQL по имени обработчика из метрик приложения"""
+    sums = registry.sums("http_request_sql_duration_seconds")
+    return {r["endpoint"]: sums.get((("method", r["method"]), ("route", r["path"])), 0.0) for r in requests}
+
+
+def build_request(template, rng, tables, counts):
+    path = template["path"]
+    for name, table in PATH_VARIABLES.items():
+        path = path.replace("{" + name + "}", str(rng.randint(1, counts[table])))
+    params = None
+    if template["method"] in ("POST", "PUT"):
+        params = dict(rng.choice(tables[template["table"]]))
+        if template["table"] == "WorkoutExercises":
+            params["workout_id"] = rng.randint(1, counts["Workouts"])
+            params["exercise_id"] = rng.randint(1, counts["Exercises"])
+        if template["table"] == "Exercises":
+            params["name"] = f"{params['name']} {rng.random()}"
+    return template["method"], path, params
+
+
+async def replay(app, requests, mix, total, concurrency, seed_value, tables, counts):
+    import httpx
+
+    rng = random.Random(seed_value)
+    weights = [MIXES[mix][r["folder"]] / sum(1 for x in requests if x["folder"] == r["folder"]) for r in requests]
+    plan = [build_request(t, rng, tables, counts) + (t["endpoint"],) for t in rng.choices(requests, weights, k=total)]
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    queue = iter(plan)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for method, path, params, endpoint in queue:
+                start = time.perf_counter()
+                response = await client.request(method, path, params=params)
+                latencies[endpoint].append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors[endpoint] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(latencies, errors, db_totals, elapsed):
+    endpoints = {}
+    for endpoint, values in sorted(latencies.items()):
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "errors": errors.get(endpoint, 0),
+            "throughput": len(values) / elapsed,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "db_ms": db_totals.get(endpoint, 0.0) / len(values) * 1000,
+        }
+    total = sum(len(v) for v in latencies.values())
+    return {"throughput": total / elapsed, "elapsed_s": elapsed, "endpoints": endpoints}
+
+
+def compare(result, baseline, tolerance):
+    """Найти эндпоинты, у которых p95 или время в базе выросли больше допуска"""
+    regressions = []
+    for endpoint, current in result["endpoints"].items():
+        previous = baseline["endpoints"].get(endpoint, {})
+        if current["errors"] > previous.get("errors", 0):
+            regressions.append(f"{endpoint}: ошибок {previous.get('errors', 0)} -> {current['errors']}")
+        if not previous or min(previous["requests"], current["requests"]) < MIN_SAMPLES:
+            continue
+        for metric in ("p95_ms", "db_ms"):
+            growth = current[metric] - previous[metric]
+            if growth > NOISE_FLOOR_MS and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{endpoint}: {metric} {previous[metric]:.2f} -> {current[metric]:.2f}")
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"всего: запросов/с {baseline['throughput']:.0f} -> {result['throughput']:.0f}")
+    return regressions
+
+
+def print_report(result):
+    print(f"{'эндпоинт':<28}{'запросов':>9}{'ошибок':>8}{'запр/с':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'база':>8}  (мс)")
+    for endpoint, m in result["endpoints"].items():
+        print(f"{endpoint:<28}{m['requests']:>9}{m['errors']:>8}{m['throughput']:>9.0f}"
+              f"{m['p50_ms']:>8.2f}{m['p95_ms']:>8.2f}{m['p99_ms']:>8.2f}{m['db_ms']:>8.2f}")
+    print(f"Всего: {result['throughput']:.0f} запросов/с за {result['elapsed_s']:.1f} с")
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000, help="число тренировок (10k-10M)")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mix", choices=sorted(MIXES), default="read-heavy")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора запросов")
+    parser.add_argument("--cache-ttl", default="0", help="TTL кэша ответов; по умолчанию кэш выключен")
+    parser.add_argument("--db", help="готовая база вместо заполнения новой (копируется не будет, база изменится)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="сохранить результат как базовый")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение (0.25 = 25%%)")
+    parser.add_argument("--output", type=Path, help="записать результат в JSON")
+    args = parser.parse_args()
+
+    # Окружение задается до импорта приложения: путь к базе и кэш читаются при импорте
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["FITNESS_DB"] = db_path
+    os.environ["FITNESS_CACHE_TTL"] = args.cache_ttl
+    os.environ["FITNESS_DB_ASYNC"] = "1"
+    # Время SQL считают обертки соединений из metrics.py
+    os.environ["FITNESS_SQL_TRACE"] = "1"
+    sys.path.insert(0, str(ROOT))
+
+    import main
+    from metrics import registry
+
+    tables = load_test_data()
+    if args.db:
+        conn = sqlite3.connect(db_path)
+        counts = {t: conn.execute(f"SELECT IFNULL(MAX(rowid), 1) FROM {t}").fetchone()[0] for t in PATH_VARIABLES.values()}
+        conn.close()
+    else:
+        start = time.perf_counter()
+        counts = seed(db_path, args.rows, tables)
+        print(f"База заполнена за {time.perf_counter() - start:.1f} с: {counts}")
+
+    requests = load_requests(main.app)
+    registry.clear()
+    latencies, errors, elapsed = asyncio.run(
+        replay(main.app, requests, args.mix, args.requests, args.concurrency, args.seed, tables, counts)
+    )
+    result = summarize(latencies, errors, sql_totals(registry, requests), elapsed)
+    result["config"] = {"rows": args.rows, "requests": args.requests, "concurrency": args.concurrency,
+                        "mix": args.mix, "seed": args.seed, "cache_ttl": args.cache_ttl}
+    print_report(result)
+
+    if args.output:
+        args.output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Базовый прогон сохранен: {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print("Базового прогона нет, сравнение пропущено (запустите с --save-baseline)")
+        return
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    if baseline.get("config") != result["config"]:
+        print("Параметры базового прогона отличаются, сравнение пропущено")
+        return
+    regressions = compare(result, baseline, args.tolerance)
+    if regressions:
+        print("Ухудшения относительно базового прогона:")
+        for line in regressions:
+            print(f"  {line}")
+        raise SystemExit(1)
+    print("Ухудшений относительно базового прогона нет")
+
+
+if __name__ == "__main__":
+    cli()
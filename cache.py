@@ -0,0 +1,186 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from starlette.responses import Response
+
+from database import active_pool
+from serialization import FastJSONResponse
+
+# Настройки кэша ответов; FITNESS_CACHE_TTL=0 отключает кэш
+CACHE_TTL = float(os.environ.get("FITNESS_CACHE_TTL", "30"))
+CACHE_MAX_ENTRIES = int(os.environ.get("FITNESS_CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.environ.get("FITNESS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+class ResponseCache:
+    """LRU-кэш готовых ответов с TTL, ограничением по памяти и инвалидацией по тегам
+
+    Каждая запись помечается тегами (например, "workouts" или "workout-exercises:5").
+    Обработчики записи сбрасывают ровно те теги, данные которых они изменили.
+    scope() - пространство ключей и тегов текущего запроса (например, база пользователя):
+    одинаковые ключи и теги в разных пространствах не пересекаются.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, scope=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # ключ -> (истекает, размер, теги, ответ)
+        self._tags = defaultdict(set)  # тег -> ключи
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.scope = scope
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    @property
+    def generation(self):
+        """Счетчик инвалидаций: меняется при каждом сбросе тегов"""
+        return self._generation
+
+    def _scoped(self, value):
+        return value if self.scope is None else (self.scope(), value)
+
+    def get(self, key):
+        key = self._scoped(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[3]
+
+    def set(self, key, value, tags, size, generation=None):
+        key = self._scoped(key)
+        tags = [self._scoped(tag) for tag in tags]
+        with self._lock:
+            # Пока ответ считался, данные могли измениться и теги - сброситься:
+            # такой ответ мог быть построен по старым данным, его не сохраняем
+            if generation is not None and generation != self._generation:
+                return
+            if size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, tags, value)
+            self._bytes += size
+            for tag in tags:
+                self._tags[tag].add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        """Удалить все записи с любым из указанных тегов"""
+        tags = [self._scoped(tag) for tag in tags]
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, tags, _ = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# Ответы разных баз (шардов пользователей) кэшируются раздельно
+response_cache = ResponseCache(scope=lambda: active_pool().path)
+
+
+def cached(*tags):
+    """Декоратор обработчика GET: кэширует готовый ответ по имени эндпоинта и параметрам
+
+    Теги могут ссылаться на параметры запроса: "workout-exercises:{workout_id}".
+    При попадании в кэш обработчик не вызывается и к базе не обращается.
+    """
+    def decorator(func):
+        def lookup(kwargs):
+            key = (func.__name__, tuple(sorted(kwargs.items())))
+            return key, response_cache.get(key)
+
+        def store(key, kwargs, response, generation):
+            # Храним уже сериализованный ответ: попадание в кэш не тратит время на JSON
+            if not isinstance(response, Response):
+                response = FastJSONResponse(content=response)
+            response_cache.set(
+                key,
+                response,
+                [tag.format(**kwargs) for tag in tags],
+                len(response.body),
+                generation
+            )
+            return response
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(**kwargs):
+                if not response_cache.enabled:
+                    return await func(**kwargs)
+                key, response = lookup(kwargs)
+                if response is not None:
+                    return response
+                generation = response_cache.generation
+                return store(key, kwargs, await func(**kwargs), generation)
+        else:
+            @functools.wraps(func)
+            def wrapper(**kwargs):
+                if not response_cache.enabled:
+                    return func(**kwargs)
+                key, response = lookup(kwargs)
+                if response is not None:
+                    return response
+                generation = response_cache.generation
+                return store(key, kwargs, func(**kwargs), generation)
+        return wrapper
+    return decorator
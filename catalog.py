@@ -0,0 +1,146 @@
+import bisect
+import os
+import threading
+import time
+
+from database import active_pool
+
+# Сколько секунд снимок справочника считается свежим. Свои записи процесс видит сразу
+# (обработчики перечитывают справочник после коммита), а TTL ограничивает, насколько
+# отстают изменения из других процессов (воркеров uvicorn) и правки базы в обход API
+CATALOG_TTL = float(os.environ.get("FITNESS_CATALOG_TTL", "5"))
+
+
+class Exercise:
+    """Упражнение из справочника"""
+
+    __slots__ = ("exercise_id", "name", "description", "muscle_group")
+
+    def __init__(self, exercise_id, name, description, muscle_group):
+        self.exercise_id = exercise_id
+        self.name = name
+        self.description = description
+        self.muscle_group = muscle_group
+
+    def as_dict(self):
+        return {
+            "exercise_id": self.exercise_id,
+            "name": self.name,
+            "description": self.description,
+            "muscle_group": self.muscle_group
+        }
+
+
+class CatalogSnapshot:
+    """Неизменяемый снимок таблицы Exercises с индексами по id и группе мышц"""
+
+    __slots__ = ("by_id", "ids", "ids_by_muscle_group", "loaded_at")
+
+    def __init__(self, rows):
+        self.loaded_at = time.monotonic()
+        # rows отсортированы по exercise_id, поэтому списки id получаются упорядоченными
+        self.by_id = {}
+        self.ids = []
+        self.ids_by_muscle_group = {}
+        for row in rows:
+            exercise = Exercise(*row)
+            self.by_id[exercise.exercise_id] = exercise
+            self.ids.append(exercise.exercise_id)
+            self.ids_by_muscle_group.setdefault(exercise.muscle_group, []).append(exercise.exercise_id)
+
+    def __contains__(self, exercise_id):
+        return exercise_id in self.by_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def missing(self, exercise_ids):
+        """Какие из exercise_ids отсутствуют в справочнике"""
+        return set(exercise_ids) - self.by_id.keys()
+
+    def page(self, after_id, limit, muscle_group=None):
+        """До limit упражнений с exercise_id > after_id (None - с начала) в порядке id"""
+        ids = self.ids if muscle_group is None else self.ids_by_muscle_group.get(muscle_group, [])
+        start = 0 if after_id is None else bisect.bisect_right(ids, after_id)
+        return [self.by_id[exercise_id] for exercise_id in ids[start:start + limit]]
+
+    def join(self, rows, index):
+        """Заменить exercise_id в колонке index на (name, muscle_group), как JOIN Exercises
+
+        Строки с упражнением, которого нет в снимке, отбрасываются: ExerciseCatalog.join()
+        перед этим перечитывает справочник, так что это только уже удаленные упражнения.
+        """
+        by_id = self.by_id
+        joined = []
+        for row in rows:
+            exercise = by_id.get(row[index])
+            if exercise is not None:
+                joined.append((*row[:index], exercise.name, exercise.muscle_group, *row[index + 1:]))
+        return joined
+
+
+class ExerciseCatalog:
+    """Справочник упражнений в памяти процесса
+
+    Читатели берут текущий снимок одной операцией и дальше работают с ним,
+    не беря блокировок. Обработчики записи в Exercises перечитывают таблицу
+    после коммита на соединении-писателе, и новый снимок подменяет старый
+    целиком: читатель никогда не увидит наполовину обновленный справочник.
+    У каждой базы (шарда пользователя) свой снимок. Снимок старше ttl секунд
+    перечитывается при следующем обращении.
+    """
+
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self._snapshots = {}  # путь к базе -> снимок
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def load(self, conn):
+        """Перечитать таблицу Exercises базы текущего запроса и заменить ее снимок"""
+        with self._lock:
+            return self._load(active_pool().path, conn)
+
+    def _load(self, path, conn):
+        rows = conn.execute("SELECT exercise_id, name, description, muscle_group FROM Exercises ORDER BY exercise_id").fetchall()
+        snapshot = self._snapshots[path] = CatalogSnapshot(rows)
+        self.reloads += 1
+        return snapshot
+
+    def snapshot(self, conn):
+        """Текущий снимок; при первом обращении и по истечении TTL справочник загружается через conn"""
+        path = active_pool().path
+        snapshot = self._snapshots.get(path)
+        if snapshot is None or self._expired(snapshot):
+            with self._lock:
+                snapshot = self._snapshots.get(path)
+                if snapshot is None or self._expired(snapshot):
+                    snapshot = self._load(path, conn)
+        return snapshot
+
+    def missing(self, conn, exercise_ids):
+        """Каких упражнений нет в справочнике; перед ответом с отсутствующими он один раз перечитывается"""
+        exercise_ids = set(exercise_ids)
+        missing = self.snapshot(conn).missing(exercise_ids)
+        if missing:
+            missing = self.load(conn).missing(exercise_ids)
+        return missing
+
+    def join(self, conn, rows, index):
+        """CatalogSnapshot.join() по текущему снимку; если в снимке нет какого-то из упражнений
+        (его создали в другом процессе), справочник один раз перечитывается через conn"""
+        snapshot = self.snapshot(conn)
+        if snapshot.missing(row[index] for row in rows):
+            snapshot = self.load(conn)
+        return snapshot.join(rows, index)
+
+    def _expired(self, snapshot):
+        return time.monotonic() - snapshot.loaded_at >= self.ttl
+
+    def forget(self, path):
+        """Освободить снимок базы, которая больше не открыта"""
+        with self._lock:
+            self._snapshots.pop(path, None)
+
+
+exercise_catalog = ExerciseCatalog()
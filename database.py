@@ -0,0 +1,315 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+import queue
+import sqlite3
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import SQL_TRACE, TracedConnection
+from repository import PostgresBackend
+
+# Путь к базе и размер пула можно переопределить через переменные окружения
+DB_PATH = os.environ.get("FITNESS_DB", "fitness_tracker.db")
+POOL_SIZE = int(os.environ.get("FITNESS_DB_POOL_SIZE", "8"))
+
+# Размер кэша подготовленных выражений на одно соединение
+STATEMENT_CACHE_SIZE = 256
+
+# Профили хранения: PRAGMA, которые выполняются на каждом новом соединении.
+# "wal" - читатели не блокируются писателем, fsync только на checkpoint.
+# "durable" - тот же WAL, но fsync на каждый коммит.
+# "rollback" - старое поведение SQLite по умолчанию.
+# Во всех профилях включены внешние ключи: SQLite проверяет их только по PRAGMA на соединении.
+STORAGE_PROFILES = {
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+        "temp_store": "MEMORY",
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+        "temp_store": "MEMORY",
+    },
+    "rollback": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+    },
+}
+STORAGE_PROFILE = os.environ.get("FITNESS_DB_PROFILE", "wal")
+
+
+def connect(path=DB_PATH, profile=STORAGE_PROFILE, **kwargs):
+    """Открыть соединение и применить к нему профиль хранения"""
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Неизвестный профиль хранения: {profile}")
+    if SQL_TRACE:
+        kwargs.setdefault("factory", TracedConnection)
+    conn = sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE, **kwargs)
+    for name, value in STORAGE_PROFILES[profile].items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений с SQLite
+
+    Соединения пула используются для чтения. Все записи идут через одно
+    соединение-писатель (writer), доступ к которому сериализован блокировкой:
+    в режиме WAL читатели при этом никогда не ждут писателя, а писатели
+    не получают "database is locked" друг от друга.
+    """
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, profile=STORAGE_PROFILE):
+        self.path = path
+        self.size = size
+        self.profile = profile
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.Lock()
+
+    def _connect(self, **kwargs):
+        # Соединение живет дольше запроса и переходит между потоками пула FastAPI,
+        # поэтому отключаем привязку к потоку; доступ к нему всегда эксклюзивный
+        return connect(self.path, self.profile, check_same_thread=False, **kwargs)
+
+    def acquire(self):
+        """Взять соединение из пула (ждет, если все заняты)"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        return self._idle.get()
+
+    def release(self, conn):
+        """Вернуть соединение в пул"""
+        # Незавершенная транзакция (например, после ошибки) не должна попасть к следующему запросу
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def writer(self):
+        """Эксклюзивный доступ к соединению-писателю"""
+        with self._write_lock:
+            if self._writer is None:
+                # IMMEDIATE: блокировка на запись берется сразу в начале транзакции,
+                # а не при первом INSERT/UPDATE, что исключает взаимные блокировки
+                self._writer = self._connect(isolation_level="IMMEDIATE")
+            try:
+                yield self._writer
+            finally:
+                if self._writer.in_transaction:
+                    self._writer.rollback()
+
+    def warm(self):
+        """Заранее открыть все соединения и загрузить схему"""
+        conns = [self.acquire() for _ in range(self.size)]
+        for conn in conns:
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        for conn in conns:
+            self.release(conn)
+        with self.writer():
+            pass
+
+    def close(self):
+        """Закрыть все свободные соединения"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+# Основная база: файл SQLite (по умолчанию) или PostgreSQL (repository.PostgresBackend, FITNESS_PG_DSN).
+# На PostgreSQL работают обработчики, которые ходят в базу через репозитории; обработчики
+# с SQL, специфичным для SQLite, помечены sqlite_only
+DB_BACKENDS = ("sqlite", "postgres")
+DB_BACKEND = os.environ.get("FITNESS_DB_BACKEND", "sqlite")
+if DB_BACKEND not in DB_BACKENDS:
+    raise ValueError(f"Неизвестный бэкенд базы: {DB_BACKEND}")
+
+pool = PostgresBackend() if DB_BACKEND == "postgres" else ConnectionPool()
+
+# Пул базы текущего запроса: файл пользователя (shards.py) или None - основная база
+current_pool = contextvars.ContextVar("current_pool", default=None)
+
+
+def active_pool():
+    """Пул, с которым работает текущий запрос"""
+    return current_pool.get() or pool
+
+
+
+# Асинхронный доступ к базе: обработчики FastAPI объявлены как async def,
+# а блокирующие вызовы sqlite3 выполняются в отдельных пулах потоков,
+# не занимая общий пул потоков FastAPI/Starlette.
+# Потоков чтения столько же, сколько соединений в пуле основной базы, поэтому поток
+# не ждет свободное соединение. У баз пользователей (shards.py) по умолчанию пулы того же
+# размера; если FITNESS_SHARD_POOL_SIZE меньше, потоки чтения ждут соединение занятой базы.
+DB_ASYNC = os.environ.get("FITNESS_DB_ASYNC", "1") != "0"
+
+# Потоков записи: у каждой базы свой писатель со своей блокировкой, поэтому при
+# шардировании (FITNESS_SHARD_DIR) записи в разные файлы идут параллельно в разных
+# потоках; записи в одну базу все равно выполняются по одной. У PostgreSQL общей
+# блокировки записи нет вовсе. В остальных случаях писатель один, и лишние потоки
+# только ждали бы его блокировку.
+# Потоки записи в основном ждут fsync, поэтому по умолчанию их больше, чем ядер
+_PARALLEL_WRITERS = bool(os.environ.get("FITNESS_SHARD_DIR")) or DB_BACKEND == "postgres"
+_DEFAULT_WRITE_THREADS = min(32, (os.cpu_count() or 1) + 4) if _PARALLEL_WRITERS else 1
+WRITE_THREADS = int(os.environ.get("FITNESS_DB_WRITE_THREADS", str(_DEFAULT_WRITE_THREADS)))
+
+# Сколько операций с базой может ожидать выполнения одновременно;
+# остальные запросы ждут в цикле событий, не создавая новых задач для потоков
+DB_QUEUE_SIZE = int(os.environ.get("FITNESS_DB_QUEUE_SIZE", "1024"))
+
+_read_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="db-read")
+_write_executor = ThreadPoolExecutor(max_workers=WRITE_THREADS, thread_name_prefix="db-write")
+_queue_slots = weakref.WeakKeyDictionary()
+
+
+def _slots():
+    # Семафор asyncio привязан к циклу событий, поэтому заводим свой на каждый цикл
+    loop = asyncio.get_running_loop()
+    slots = _queue_slots.get(loop)
+    if slots is None:
+        slots = _queue_slots[loop] = asyncio.Semaphore(DB_QUEUE_SIZE)
+    return slots
+
+
+def _read(func, args, kwargs):
+    with active_pool().connection() as conn:
+        return func(conn, *args, **kwargs)
+
+
+def _write(func, args, kwargs):
+    with active_pool().writer() as conn:
+        return func(conn, *args, **kwargs)
+
+
+async def run_read(func, *args, **kwargs):
+    """Выполнить func(conn, ...) на соединении из пула в потоке чтения"""
+    # Копия контекста переносит в поток базы статистику текущего HTTP-запроса (metrics.current_request)
+    context = contextvars.copy_context()
+    async with _slots():
+        return await asyncio.get_running_loop().run_in_executor(_read_executor, context.run, _read, func, args, kwargs)
+
+
+async def run_write(func, *args, **kwargs):
+    """Выполнить func(conn, ...) на соединении-писателе в потоке записи"""
+    context = contextvars.copy_context()
+    async with _slots():
+        return await asyncio.get_running_loop().run_in_executor(_write_executor, context.run, _write, func, args, kwargs)
+
+
+def _endpoint(func, runner, sync_call):
+    # FastAPI берет параметры запроса из сигнатуры: conn передается не клиентом, а этим декоратором
+    signature = inspect.signature(func)
+    parameters = [p for name, p in signature.parameters.items() if name != "conn"]
+
+    if DB_ASYNC:
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            return await runner(func, **kwargs)
+    else:
+        # Синхронный режим (FITNESS_DB_ASYNC=0): обработчик выполняется в пуле потоков FastAPI,
+        # как до перехода на async; оставлен для сравнения в benchmarks/async_benchmark.py
+        @functools.wraps(func)
+        def wrapper(**kwargs):
+            return sync_call(func, (), kwargs)
+
+    wrapper.__signature__ = signature.replace(parameters=parameters)
+    return wrapper
+
+
+def db_read(func):
+    """Декоратор обработчика, который только читает: func(conn, ...) -> async def (...)"""
+    return _endpoint(func, run_read, _read)
+
+
+def db_read_with(call):
+    """Декоратор обработчика, который читает через call(func, args, kwargs) в потоке чтения,
+    например не из пула, а из снимка базы (snapshot.py)"""
+    async def runner(func, *args, **kwargs):
+        context = contextvars.copy_context()
+        async with _slots():
+            return await asyncio.get_running_loop().run_in_executor(_read_executor, context.run, call, func, args, kwargs)
+
+    def decorator(func):
+        return _endpoint(func, runner, call)
+    return decorator
+
+
+def db_write(func):
+    """Декоратор обработчика, который пишет: записи в одну базу выполняются по одной в потоках записи"""
+    return _endpoint(func, run_write, _write)
+
+
+def sqlite_only(func):
+    """Декоратор обработчика с SQL, специфичным для SQLite (FTS5, json_each, триггерные агрегаты):
+    если база запроса - PostgreSQL, обработчик не вызывается и возвращается ошибка"""
+    def unsupported():
+        return not isinstance(active_pool(), ConnectionPool)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if unsupported():
+                return {"error": "Недоступно для базы PostgreSQL"}
+            return await func(*args, **kwargs)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if unsupported():
+                return {"error": "Недоступно для базы PostgreSQL"}
+            return func(*args, **kwargs)
+    return wrapper
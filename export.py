@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+
+from database import connect
+
+# Сколько строк забирать из курсора за один раз
+EXPORT_BATCH_SIZE = 1000
+
+# Имя в URL -> (таблица, колонки в порядке выгрузки)
+EXPORT_TABLES = {
+    "workouts": ("Workouts", ["workout_id", "title", "workout_type", "duration_minutes", "calories_burned", "date", "notes"]),
+    "exercises": ("Exercises", ["exercise_id", "name", "description", "muscle_group"]),
+    "progress": ("Progress", ["progress_id", "date", "weight", "height", "body_fat_percentage", "muscle_mass", "notes"]),
+    "workout-exercises": ("WorkoutExercises", ["workout_exercise_id", "workout_id", "exercise_id", "sets", "reps", "weight_kg", "duration_seconds"]),
+}
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def iter_rows(db, table, columns, batch_size=EXPORT_BATCH_SIZE):
+    """Читать таблицу базы пула db пачками по первичному ключу, не загружая ее целиком"""
+    # Выгрузка может идти долго, поэтому у нее свое соединение, а не соединение из пула:
+    # иначе несколько медленных клиентов заняли бы все соединения для обычных запросов.
+    # Генератор дочитывается в пуле потоков Starlette уже после возврата ответа.
+    conn = connect(db.path, db.profile, check_same_thread=False)
+    try:
+        cursor = conn.cursor()
+        cursor.arraysize = batch_size
+        cursor.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {columns[0]}")
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def stream_ndjson(db, table, columns):
+    for rows in iter_rows(db, table, columns):
+        yield "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+
+
+def stream_csv(db, table, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for rows in iter_rows(db, table, columns):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+STREAMERS = {
+    "ndjson": stream_ndjson,
+    "csv": stream_csv,
+}
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from fastapi.responses import Response
+
+from repository import execute
+from serialization import FastJSONResponse
+
+# Заголовок, по которому клиент помечает повторы одного и того же POST
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# Сколько секунд хранится ответ на запрос с ключом
+IDEMPOTENCY_TTL = int(os.environ.get("FITNESS_IDEMPOTENCY_TTL", "86400"))
+# Просроченные ключи удаляются раз в столько сохраненных ключей
+IDEMPOTENCY_PURGE_EVERY = 1000
+# Заголовок ответа, который отдан из таблицы ключей, а не создан заново
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+def fingerprint(params):
+    """Отпечаток параметров запроса: ключ нельзя переиспользовать для другого запроса"""
+    data = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str).encode()
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class IdempotencyStore:
+    """Ответы на запросы с ключом идемпотентности в таблице IdempotencyKeys
+
+    replay() открывает транзакцию BEGIN IMMEDIATE до поиска ключа, а remember() сохраняет
+    ключ в той же транзакции, что и создаваемую строку. Блокировка на запись берется
+    на файл базы, поэтому и несколько процессов (воркеров uvicorn) проверяют и сохраняют
+    один ключ по очереди. На PostgreSQL ту же роль играет транзакционная advisory-блокировка
+    по ключу. Если транзакцию открыл не replay(), повтор ключа отклоняется
+    первичным ключом таблицы (IntegrityError), и строка откатывается вместе с ним.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, purge_every=IDEMPOTENCY_PURGE_EVERY):
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._stored = 0
+
+    def replay(self, conn, scope, key, params):
+        """Сохраненный ответ на запрос с этим ключом или None, если запроса еще не было"""
+        if key is None:
+            return None
+        if not isinstance(conn, sqlite3.Connection):
+            conn.execute("SELECT pg_advisory_xact_lock(hashtextextended(%s, 0))", (f"{scope}:{key}",))
+        elif not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        row = execute(
+            conn,
+            "SELECT fingerprint, response, created_at FROM IdempotencyKeys WHERE scope = ? AND key = ?",
+            (scope, key)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[2] <= time.time() - self.ttl:
+            execute(conn, "DELETE FROM IdempotencyKeys WHERE scope = ? AND key = ?", (scope, key))
+            return None
+        if row[0] != fingerprint(params):
+            return {"error": f"Ключ {IDEMPOTENCY_HEADER} уже использован для запроса с другими параметрами"}
+        return Response(row[1], media_type="application/json", headers={REPLAY_HEADER: "true"})
+
+    def remember(self, conn, scope, key, params, response):
+        """Сохранить ответ в текущей транзакции (после replay()); коммит делает вызывающий"""
+        if key is None:
+            return
+        execute(
+            conn,
+            "INSERT INTO IdempotencyKeys (scope, key, fingerprint, response, created_at) VALUES (?, ?, ?, ?, ?)",
+            (scope, key, fingerprint(params), FastJSONResponse(response).body, int(time.time()))
+        )
+        self._stored += 1
+        if self._stored % self.purge_every == 0:
+            self.purge(conn)
+
+    def purge(self, conn):
+        """Удалить просроченные ключи"""
+        return execute(conn, "DELETE FROM IdempotencyKeys WHERE created_at <= ?", (time.time() - self.ttl,)).rowcount
+
+
+idempotency_store = IdempotencyStore()
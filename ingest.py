@@ -0,0 +1,237 @@
+import functools
+import inspect
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+
+from cache import response_cache
+from database import active_pool, current_pool
+
+# Отложенная запись: POST ставит строку в очередь, фоновый поток пишет пачками в одной транзакции.
+# Выключена по умолчанию: подтверждение означает "принято", а не "записано", и очередь
+# в памяти процесса теряется при его падении
+WRITE_BEHIND = os.environ.get("FITNESS_WRITE_BEHIND", "0") != "0"
+# Пачка пишется, когда набралось столько строк или первая строка ждет дольше задержки
+INGEST_BATCH_SIZE = int(os.environ.get("FITNESS_INGEST_BATCH_SIZE", "500"))
+INGEST_MAX_DELAY = float(os.environ.get("FITNESS_INGEST_MAX_DELAY_MS", "20")) / 1000
+# Сколько строк может ждать записи; при переполнении POST получает ошибку
+INGEST_QUEUE_SIZE = int(os.environ.get("FITNESS_INGEST_QUEUE_SIZE", "100000"))
+# Для скольких последних токенов хранить id созданной строки
+INGEST_RESULTS_KEEP = int(os.environ.get("FITNESS_INGEST_RESULTS_KEEP", "100000"))
+
+ingest_log = logging.getLogger("fitness.ingest")
+
+
+class IngestItem:
+    __slots__ = ("token", "db", "repository", "values", "tags")
+
+    def __init__(self, token, db, repository, values, tags):
+        self.token = token
+        self.db = db
+        self.repository = repository
+        self.values = values
+        self.tags = tags
+
+
+class IngestQueue:
+    """Очередь отложенной записи с групповым коммитом
+
+    Каждая принятая строка получает токен - порядковый номер. Один фоновый поток
+    забирает строки по порядку и пишет пачку одной транзакцией на соединении-писателе:
+    один коммит (и один fsync в профиле "durable") на пачку, а не на строку.
+    Если пачка не записалась (например, нарушен внешний ключ), ее строки пишутся
+    по одной, и ошибка достается только своему токену.
+    """
+
+    def __init__(self, batch_size=INGEST_BATCH_SIZE, max_delay=INGEST_MAX_DELAY,
+                 max_size=INGEST_QUEUE_SIZE, keep_results=INGEST_RESULTS_KEEP):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.keep_results = keep_results
+        self._queue = queue.Queue(max_size)
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._resolved = 0  # все токены до этого включительно записаны или отклонены
+        # Токен -> путь базы, в которую пишется строка: статус виден только запросам к той же базе
+        self._pending = {}
+        self._results = OrderedDict()  # токен -> (путь базы, id созданной строки)
+        self._errors = OrderedDict()  # токен -> (путь базы, текст ошибки)
+        self._thread = None
+        self.batches = 0
+        self.rows = 0
+
+    def submit(self, repository, values, tags=()):
+        """Поставить строку в очередь; токен или None, если очередь переполнена"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-ingest", daemon=True)
+                self._thread.start()
+            # Токены выдаются и ставятся в очередь под одной блокировкой, поэтому идут в ней по порядку;
+            # токен считается выданным, только если строка попала в очередь
+            token = self._issued + 1
+            db = active_pool()
+            try:
+                self._queue.put_nowait(IngestItem(token, db, repository, values, tags))
+            except queue.Full:
+                return None
+            self._issued = token
+            self._pending[token] = db.path
+            return token
+
+    def status(self, token):
+        """Состояние записи по токену: pending, committed (с id строки), failed или unknown
+
+        Токен чужой базы (другого пользователя, shards.py) и токен, результат которого
+        уже вытеснен, не отличаются от несуществующего: unknown.
+        """
+        path = active_pool().path
+        with self._lock:
+            if self._pending.get(token) == path:
+                return {"token": token, "status": "pending"}
+            owner, row_id = self._results.get(token, (None, None))
+            if owner == path:
+                return {"token": token, "status": "committed", "id": row_id}
+            owner, error = self._errors.get(token, (None, None))
+            if owner == path:
+                return {"token": token, "status": "failed", "error": error}
+            return {"token": token, "status": "unknown"}
+
+    def close(self):
+        """Дописать все, что стоит в очереди, и остановить поток"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            if stop:
+                return
+
+    def _flush(self, batch):
+        # У запросов разных пользователей разные базы (shards.py): каждая пишется своей транзакцией,
+        # и ошибка одной базы не меняет статус строк, уже записанных в другую
+        by_db = OrderedDict()
+        for item in batch:
+            by_db.setdefault(item.db, []).append(item)
+
+        results = {}
+        errors = {}
+        try:
+            for db, items in by_db.items():
+                context = current_pool.set(db)
+                try:
+                    self._write(db, items, results, errors)
+                    committed = [item for item in items if item.token in results]
+                    response_cache.invalidate(*{tag.format(**item.values) for item in committed for tag in item.tags})
+                except Exception as e:
+                    ingest_log.exception("Не удалось записать пачку из очереди в %s", db.path)
+                    errors.update((item.token, str(e)) for item in items if item.token not in results)
+                finally:
+                    current_pool.reset(context)
+        finally:
+            self._resolve(batch, results, errors)
+
+    def _write(self, db, items, results, errors):
+        with db.writer() as conn:
+            try:
+                ids = [item.repository.create(conn, **item.values) for item in items]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+            else:
+                results.update((item.token, row_id) for item, row_id in zip(items, ids))
+                return
+            for item in items:
+                try:
+                    row_id = item.repository.create(conn, **item.values)
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    errors[item.token] = str(e)
+                else:
+                    results[item.token] = row_id
+
+    def _resolve(self, batch, results, errors):
+        with self._lock:
+            for item in batch:
+                path = self._pending.pop(item.token, None)
+                if item.token in results:
+                    self._results[item.token] = (path, results[item.token])
+                else:
+                    self._errors[item.token] = (path, errors.get(item.token, "Запись прервана"))
+            for done in (self._results, self._errors):
+                while len(done) > self.keep_results:
+                    done.popitem(last=False)
+            self._resolved = batch[-1].token
+            self.batches += 1
+            self.rows += len(results)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": WRITE_BEHIND,
+                "queued": self._queue.qsize(),
+                "issued": self._issued,
+                "resolved": self._resolved,
+                "batches": self.batches,
+                "rows": self.rows,
+                "batch_size": self.batch_size,
+                "max_delay_ms": self.max_delay * 1000,
+            }
+
+
+ingest_queue = IngestQueue()
+
+
+def write_behind(repository, *tags):
+    """Декоратор POST-обработчика создания строки: в режиме FITNESS_WRITE_BEHIND
+    параметры запроса ставятся в очередь вместо записи в базу
+
+    Параметры обработчика должны совпадать с колонками таблицы репозитория.
+    Теги кэша, как и в cached(), могут ссылаться на параметры: "workout-exercises:{workout_id}".
+    Запрос с заголовком Idempotency-Key (параметр idempotency_key) пишется сразу обработчиком:
+    ключ и строка должны фиксироваться одной транзакцией (idempotency.py).
+    """
+    def decorator(endpoint):
+        if not WRITE_BEHIND:
+            return endpoint
+
+        @functools.wraps(endpoint)
+        async def wrapper(**kwargs):
+            if kwargs.get("idempotency_key") is not None:
+                if inspect.iscoroutinefunction(endpoint):
+                    return await endpoint(**kwargs)
+                return await run_in_threadpool(endpoint, **kwargs)
+            kwargs.pop("idempotency_key", None)
+            token = ingest_queue.submit(repository, kwargs, tags)
+            if token is None:
+                return {"error": "Очередь записи переполнена, повторите позже"}
+            return {"token": token, "status": "pending", "message": "Запись принята в очередь"}
+
+        wrapper.__signature__ = inspect.signature(endpoint)
+        return wrapper
+    return decorator
@@ -1,463 +1,724 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Body, Header, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import json
 import sqlite3
 from datetime import date
+from typing import List, Optional
+from pydantic import BaseModel, Field
 
-app = FastAPI()
-
-# Создаем базу данных и таблицы
-conn = sqlite3.connect("fitness_tracker.db")
-cursor = conn.cursor()
-
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Workouts (
-        workout_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        workout_type TEXT NOT NULL,
-        duration_minutes INTEGER NOT NULL,
-        calories_burned INTEGER,
-        date DATE NOT NULL,
-        notes TEXT
-    )
-''')
-
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Exercises (
-        exercise_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        description TEXT,
-        muscle_group TEXT
-    )
-''')
-
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Progress (
-        progress_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        date DATE NOT NULL,
-        weight REAL,
-        height REAL,
-        body_fat_percentage REAL,
-        muscle_mass REAL,
-        notes TEXT
-    )
-''')
-
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS WorkoutExercises (
-        workout_exercise_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        workout_id INTEGER,
-        exercise_id INTEGER,
-        sets INTEGER,
-        reps INTEGER,
-        weight_kg REAL,
-        duration_seconds INTEGER
-    )
-''')
+from cache import cached, response_cache
+from catalog import exercise_catalog
+from database import DB_BACKEND, DB_PATH, active_pool, connect, pool, db_read, db_write, sqlite_only
+from export import EXPORT_FORMATS, EXPORT_TABLES, STREAMERS
+from idempotency import IDEMPOTENCY_KEY_MAX_LENGTH, idempotency_store
+from ingest import ingest_queue, write_behind
+from metrics import MetricsMiddleware, registry
+from migrations import migrate
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SORT_DIRECTIONS, decode_cursor, keyset, page_response, split_page
+from repository import INTEGRITY_ERRORS, exercise_repository, progress_repository, workout_exercise_repository, workout_repository
+from search import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT, SEARCH_CANDIDATES, SEARCH_SCOPES, build_match, search
+from serialization import FastJSONResponse, rows_as_dicts
+from shards import ShardMiddleware, shard_registry
+from snapshot import db_snapshot, snapshot_replica
+from updates import changed_fields, where_clause
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Открываем соединения заранее, чтобы первые запросы не платили за подключение
+    pool.warm()
+    with pool.connection() as conn:
+        exercise_catalog.load(conn)
+    snapshot_replica.start()
+    yield
+    # Очередь отложенной записи дописывается до закрытия соединений
+    ingest_queue.close()
+    snapshot_replica.stop()
+    pool.close()
+    if shard_registry is not None:
+        shard_registry.close()
 
-conn.commit()
-conn.close()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+app.add_middleware(ShardMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+# Создаем базу данных и применяем недостающие миграции схемы;
+# таблицы PostgreSQL создает pool.warm() при запуске
+if DB_BACKEND == "sqlite":
+    conn = connect(DB_PATH)
+    migrate(conn)
+    conn.close()
 
 # Тренировки
 @app.post("/workouts/")
-def create_workout(title: str, workout_type: str, duration_minutes: int, date: str, calories_burned: int = None, notes: str = ""):
-    """Создание тренировки"""
-    conn = sqlite3.connect("fitness_tracker.db")
+@write_behind(workout_repository, "workouts", "stats:workouts", "stats:timeseries")
+@db_write
+def create_workout(conn: sqlite3.Connection, title: str, workout_type: str, duration_minutes: int, date: str, calories_burned: int = None, notes: str = "",
+                   idempotency_key: Optional[str] = Header(None, max_length=IDEMPOTENCY_KEY_MAX_LENGTH)):
+    """Создание тренировки; повтор с тем же заголовком Idempotency-Key возвращает первый ответ"""
+    values = dict(title=title, workout_type=workout_type, duration_minutes=duration_minutes,
+                  calories_burned=calories_burned, date=date, notes=notes)
+    replay = idempotency_store.replay(conn, "workouts", idempotency_key, values)
+    if replay is not None:
+        return replay
+    try:
+        workout_id = workout_repository.create(conn, **values)
+        response = {"workout_id": workout_id, "message": "Тренировка создана"}
+        idempotency_store.remember(conn, "workouts", idempotency_key, values, response)
+        conn.commit()
+        response_cache.invalidate("workouts", "stats:workouts", "stats:timeseries", f"workout-exercises:{workout_id}")
+        return response
+    except Exception as e:
+        return {"error": f"Ошибка создания тренировки: {str(e)}"}
+
+# Пакетная загрузка тренировок вместе с упражнениями
+MAX_BULK_WORKOUTS = 5000
+
+
+class BulkWorkoutExercise(BaseModel):
+    exercise_id: int
+    sets: Optional[int] = None
+    reps: Optional[int] = None
+    weight_kg: Optional[float] = None
+    duration_seconds: Optional[int] = None
+
+
+class BulkWorkout(BaseModel):
+    title: str
+    workout_type: str
+    duration_minutes: int
+    date: str
+    calories_burned: Optional[int] = None
+    notes: str = ""
+    exercises: List[BulkWorkoutExercise] = []
+
+
+@app.post("/workouts/bulk")
+@sqlite_only
+@db_write
+def create_workouts_bulk(conn: sqlite3.Connection, workouts: List[BulkWorkout] = Body(..., max_length=MAX_BULK_WORKOUTS)):
+    """Пакетное создание тренировок с упражнениями в одной транзакции"""
+    if not workouts:
+        return {"error": "Нет тренировок для загрузки"}
+
     cursor = conn.cursor()
     try:
-        cursor.execute(
+        # Проверяем все упражнения по справочнику в памяти; к базе - только если какого-то в нем нет
+        missing = exercise_catalog.missing(conn, (e.exercise_id for w in workouts for e in w.exercises))
+        if missing:
+            return {"error": f"Упражнения не найдены: {sorted(missing)}"}
+
+        cursor.executemany(
             "INSERT INTO Workouts (title, workout_type, duration_minutes, calories_burned, date, notes) VALUES (?, ?, ?, ?, ?, ?)",
-            (title, workout_type, duration_minutes, calories_burned, date, notes)
+            [(w.title, w.workout_type, w.duration_minutes, w.calories_burned, w.date, w.notes) for w in workouts]
         )
+        # Транзакция держит блокировку записи, а AUTOINCREMENT выдает id подряд,
+        # поэтому id пакета - это непрерывный диапазон, заканчивающийся last_insert_rowid()
+        last_workout_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+        workout_ids = list(range(last_workout_id - len(workouts) + 1, last_workout_id + 1))
+
+        exercise_rows = [
+            (workout_id, e.exercise_id, e.sets, e.reps, e.weight_kg, e.duration_seconds)
+            for workout_id, w in zip(workout_ids, workouts) for e in w.exercises
+        ]
+        workout_exercise_ids = []
+        if exercise_rows:
+            cursor.executemany(
+                "INSERT INTO WorkoutExercises (workout_id, exercise_id, sets, reps, weight_kg, duration_seconds) VALUES (?, ?, ?, ?, ?, ?)",
+                exercise_rows
+            )
+            last_we_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+            workout_exercise_ids = list(range(last_we_id - len(exercise_rows) + 1, last_we_id + 1))
+
         conn.commit()
-        workout_id = cursor.lastrowid
-        return {"workout_id": workout_id, "message": "Тренировка создана"}
+        response_cache.invalidate("workouts", "stats:workouts", "stats:timeseries", *(f"workout-exercises:{workout_id}" for workout_id in workout_ids))
     except Exception as e:
-        return {"error": f"Ошибка создания тренировки: {str(e)}"}
-    finally:
-        conn.close()
+        conn.rollback()
+        return {"error": f"Ошибка пакетной загрузки тренировок: {str(e)}"}
+
+    created = []
+    offset = 0
+    for workout_id, w in zip(workout_ids, workouts):
+        created.append({
+            "workout_id": workout_id,
+            "workout_exercise_ids": workout_exercise_ids[offset:offset + len(w.exercises)]
+        })
+        offset += len(w.exercises)
+    return {"workouts": created, "message": f"Создано тренировок: {len(created)}"}
+
+# Пакетное удаление и изменение по списку id и/или фильтрам
+MAX_BULK_IDS = 10000
+
+
+class WorkoutFilter(BaseModel):
+    ids: Optional[List[int]] = Field(None, max_length=MAX_BULK_IDS)
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    workout_type: Optional[str] = None
+    muscle_group: Optional[str] = None
+
+    def where(self):
+        return where_clause("workout_id", self.ids, [
+            ("date >= ?", self.date_from),
+            ("date <= ?", self.date_to),
+            ("workout_type = ?", self.workout_type),
+            # Тренировки, в которых есть упражнение на эту группу мышц
+            ("workout_id IN (SELECT we.workout_id FROM WorkoutExercises we JOIN Exercises e ON we.exercise_id = e.exercise_id WHERE e.muscle_group = ?)", self.muscle_group),
+        ])
+
+
+class WorkoutChanges(BaseModel):
+    title: Optional[str] = None
+    workout_type: Optional[str] = None
+    duration_minutes: Optional[int] = None
+    calories_burned: Optional[int] = None
+    date: Optional[str] = None
+    notes: Optional[str] = None
+
+
+class WorkoutBulkUpdate(WorkoutFilter):
+    changes: WorkoutChanges
+
+
+@app.delete("/workouts/bulk")
+@sqlite_only
+@db_write
+def delete_workouts_bulk(conn: sqlite3.Connection, selection: WorkoutFilter):
+    """Удаление тренировок по списку id и/или фильтрам в одной транзакции"""
+    where, params = selection.where()
+    if not where:
+        return {"error": "Не заданы ни id, ни фильтры"}
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT workout_id FROM Workouts WHERE {where}", params)
+        workout_ids = json.dumps([row[0] for row in cursor.fetchall()])
+
+        # Упражнения всех выбранных тренировок удаляются одним запросом,
+        # а не каскадом по внешнему ключу для каждой тренировки отдельно
+        cursor.execute("DELETE FROM WorkoutExercises WHERE workout_id IN (SELECT value FROM json_each(?))", (workout_ids,))
+        workout_exercises_deleted = cursor.rowcount
+        cursor.execute("DELETE FROM Workouts WHERE workout_id IN (SELECT value FROM json_each(?)) RETURNING workout_id", (workout_ids,))
+        deleted = [row[0] for row in cursor.fetchall()]
+
+        conn.commit()
+        response_cache.invalidate("workouts", "stats:workouts", "stats:timeseries", *(f"workout-exercises:{workout_id}" for workout_id in deleted))
+        return {"deleted": len(deleted), "workout_exercises_deleted": workout_exercises_deleted, "message": f"Удалено тренировок: {len(deleted)}"}
+    except Exception as e:
+        conn.rollback()
+        return {"error": f"Ошибка пакетного удаления тренировок: {str(e)}"}
+
+@app.put("/workouts/bulk")
+@sqlite_only
+@db_write
+def update_workouts_bulk(conn: sqlite3.Connection, update: WorkoutBulkUpdate):
+    """Изменение тренировок по списку id и/или фильтрам одним UPDATE"""
+    where, params = update.where()
+    if not where:
+        return {"error": "Не заданы ни id, ни фильтры"}
+    fields = changed_fields(**update.changes.model_dump())
+    if not fields:
+        return {"error": "Нет данных для обновления"}
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"UPDATE Workouts SET {', '.join(f'{field} = ?' for field in fields)} WHERE {where}", (*fields.values(), *params))
+        updated = cursor.rowcount
+        conn.commit()
+        response_cache.invalidate("workouts", "stats:workouts", "stats:timeseries")
+        return {"updated": updated, "message": f"Обновлено тренировок: {updated}"}
+    except Exception as e:
+        conn.rollback()
+        return {"error": f"Ошибка пакетного изменения тренировок: {str(e)}"}
+
+# Колонки для сортировки списков: только NOT NULL, иначе ключ курсора может оказаться NULL
+WORKOUT_COLUMNS = ("workout_id", "title", "workout_type", "duration_minutes", "calories_burned", "date", "notes")
+WORKOUT_SORT_FIELDS = {"date", "duration_minutes", "workout_id"}
+WORKOUT_EXPANSIONS = {None, "exercises"}
+# Поля упражнения в тренировке в ответах (e.name отдается как exercise_name)
+WORKOUT_EXERCISE_FIELDS = ("workout_exercise_id", "exercise_name", "muscle_group", "sets", "reps", "weight_kg", "duration_seconds")
 
 @app.get("/workouts/")
-def get_workouts():
-    """Получить все тренировки"""
-    conn = sqlite3.connect("fitness_tracker.db")
+@sqlite_only
+@cached("workouts", "workouts-expand:{expand}")
+@db_read
+def get_workouts(
+    conn: sqlite3.Connection,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    page_cursor: str = Query(None, alias="cursor"),
+    date_from: str = None,
+    date_to: str = None,
+    workout_type: str = None,
+    min_duration: int = None,
+    max_duration: int = None,
+    min_calories: int = None,
+    max_calories: int = None,
+    sort: str = "date",
+    order: str = "desc",
+    expand: str = None
+):
+    """Получить тренировки постранично с фильтрами (по умолчанию от новых к старым)
+
+    expand=exercises - вложить в каждую тренировку список ее упражнений.
+    """
+    if expand not in WORKOUT_EXPANSIONS:
+        return {"error": f"Неизвестное значение expand: {expand}"}
+    if sort not in WORKOUT_SORT_FIELDS:
+        return {"error": f"Сортировка по полю {sort} недоступна"}
+    if order not in SORT_DIRECTIONS:
+        return {"error": f"Неизвестное направление сортировки: {order}"}
+
+    # Фильтры и сортировка выполняются в SQL по индексам, клиент получает только нужные строки
+    where, params = where_clause("workout_id", None, [
+        ("date >= ?", date_from),
+        ("date <= ?", date_to),
+        ("workout_type = ?", workout_type),
+        ("duration_minutes >= ?", min_duration),
+        ("duration_minutes <= ?", max_duration),
+        ("calories_burned >= ?", min_calories),
+        ("calories_burned <= ?", max_calories),
+    ])
+    try:
+        after, after_params, order_by = keyset(sort, "workout_id", order, page_cursor)
+    except ValueError as e:
+        return {"error": str(e)}
+    conditions = [c for c in (where, after) if c]
+    query = f"SELECT {', '.join(WORKOUT_COLUMNS)} FROM Workouts"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    query += f" ORDER BY {order_by} LIMIT ?"
+    params += after_params
+    params.append(limit + 1)
+
+    sort_index = WORKOUT_COLUMNS.index(sort)
     cursor = conn.cursor()
-    cursor.execute("SELECT workout_id, title, workout_type, duration_minutes, calories_burned, date, notes FROM Workouts ORDER BY date DESC")
-    workouts = cursor.fetchall()
-    conn.close()
+    cursor.execute(query, params)
+    workouts, next_cursor = split_page(cursor.fetchall(), limit, lambda w: (w[sort_index], w[0]))
     
     if not workouts:
         return {"error": "Список тренировок пуст"}
     
-    return [{
-        "workout_id": w[0], 
-        "title": w[1], 
-        "workout_type": w[2], 
-        "duration_minutes": w[3], 
-        "calories_burned": w[4], 
-        "date": w[5], 
-        "notes": w[6]
-    } for w in workouts]
+    items = rows_as_dicts(WORKOUT_COLUMNS, workouts)
+
+    if expand == "exercises":
+        # Упражнения всей страницы одним запросом вместо GET /workout-exercises/{id} на каждую тренировку
+        by_id = {}
+        for item in items:
+            item["exercises"] = []
+            by_id[item["workout_id"]] = item["exercises"]
+        cursor.execute('''
+            SELECT workout_id, workout_exercise_id, exercise_id, sets, reps, weight_kg, duration_seconds
+            FROM WorkoutExercises
+            WHERE workout_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(list(by_id)),))
+        rows = exercise_catalog.join(conn, cursor.fetchall(), 2)
+        for exercise in rows_as_dicts(("workout_id",) + WORKOUT_EXERCISE_FIELDS, rows):
+            by_id[exercise.pop("workout_id")].append(exercise)
+
+    return page_response(items, next_cursor)
 
 @app.put("/workouts/{workout_id}")
-def update_workout(workout_id: int, title: str = None, workout_type: str = None, duration_minutes: int = None, calories_burned: int = None, date: str = None, notes: str = None):
-    """Обновление тренировки"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
+@db_write
+def update_workout(conn: sqlite3.Connection, workout_id: int, title: str = None, workout_type: str = None, duration_minutes: int = None, calories_burned: int = None, date: str = None, notes: str = None, returning: bool = False):
+    """Обновление тренировки (returning=true - вернуть обновленную строку)"""
+    fields = changed_fields(title=title, workout_type=workout_type, duration_minutes=duration_minutes, calories_burned=calories_burned, date=date, notes=notes)
+    if not fields:
+        return {"error": "Нет данных для обновления"}
     try:
-        # Проверяем существование тренировки
-        cursor.execute("SELECT * FROM Workouts WHERE workout_id = ?", (workout_id,))
-        workout = cursor.fetchone()
-        
-        if not workout:
+        # Один UPDATE: отсутствие строки видно по числу измененных строк
+        workout = workout_repository.update(conn, workout_id, fields, ("*",) if returning else ())
+        if workout is None:
             return {"error": "Тренировка не найдена"}
-        
-        # Собираем поля для обновления
-        update_fields = []
-        update_values = []
-        
-        if title is not None:
-            update_fields.append("title = ?")
-            update_values.append(title)
-        if workout_type is not None:
-            update_fields.append("workout_type = ?")
-            update_values.append(workout_type)
-        if duration_minutes is not None:
-            update_fields.append("duration_minutes = ?")
-            update_values.append(duration_minutes)
-        if calories_burned is not None:
-            update_fields.append("calories_burned = ?")
-            update_values.append(calories_burned)
-        if date is not None:
-            update_fields.append("date = ?")
-            update_values.append(date)
-        if notes is not None:
-            update_fields.append("notes = ?")
-            update_values.append(notes)
-        
-        if not update_fields:
-            return {"error": "Нет данных для обновления"}
-        
-        update_values.append(workout_id)
-        query = f"UPDATE Workouts SET {', '.join(update_fields)} WHERE workout_id = ?"
-        
-        cursor.execute(query, update_values)
         conn.commit()
+        response_cache.invalidate("workouts", "stats:workouts", "stats:timeseries")
         
+        if returning:
+            return {"message": "Тренировка обновлена", "workout": workout}
         return {"message": "Тренировка обновлена"}
     except Exception as e:
         return {"error": f"Ошибка обновления тренировки: {str(e)}"}
-    finally:
-        conn.close()
 
 # Упражнения
 @app.post("/exercises/")
-def create_exercise(name: str, description: str = "", muscle_group: str = ""):
+@db_write
+def create_exercise(conn: sqlite3.Connection, name: str, description: str = "", muscle_group: str = ""):
     """Создание упражнения"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
     try:
-        cursor.execute(
-            "INSERT INTO Exercises (name, description, muscle_group) VALUES (?, ?, ?)",
-            (name, description, muscle_group)
-        )
+        exercise_id = exercise_repository.create(conn, name=name, description=description, muscle_group=muscle_group)
         conn.commit()
-        exercise_id = cursor.lastrowid
+        exercise_catalog.load(conn)
+        response_cache.invalidate("exercises")
         return {"exercise_id": exercise_id, "message": "Упражнение создано"}
     except:
         return {"error": "Такое упражнение уже существует"}
-    finally:
-        conn.close()
 
-@app.get("/exercises/")
-def get_exercises():
-    """Получить все упражнения"""
-    conn = sqlite3.connect("fitness_tracker.db")
+class ExerciseFilter(BaseModel):
+    ids: Optional[List[int]] = Field(None, max_length=MAX_BULK_IDS)
+    muscle_group: Optional[str] = None
+
+    def where(self):
+        return where_clause("exercise_id", self.ids, [("muscle_group = ?", self.muscle_group)])
+
+
+class ExerciseChanges(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    muscle_group: Optional[str] = None
+
+
+class ExerciseBulkUpdate(ExerciseFilter):
+    changes: ExerciseChanges
+
+
+@app.delete("/exercises/bulk")
+@sqlite_only
+@db_write
+def delete_exercises_bulk(conn: sqlite3.Connection, selection: ExerciseFilter):
+    """Удаление упражнений по списку id и/или группе мышц в одной транзакции"""
+    where, params = selection.where()
+    if not where:
+        return {"error": "Не заданы ни id, ни фильтры"}
+
     cursor = conn.cursor()
-    cursor.execute("SELECT exercise_id, name, description, muscle_group FROM Exercises")
-    exercises = cursor.fetchall()
-    conn.close()
+    try:
+        cursor.execute(f"SELECT exercise_id FROM Exercises WHERE {where}", params)
+        exercise_ids = json.dumps([row[0] for row in cursor.fetchall()])
+
+        cursor.execute("DELETE FROM WorkoutExercises WHERE exercise_id IN (SELECT value FROM json_each(?)) RETURNING workout_id", (exercise_ids,))
+        affected_workouts = [row[0] for row in cursor.fetchall()]
+        cursor.execute("DELETE FROM Exercises WHERE exercise_id IN (SELECT value FROM json_each(?))", (exercise_ids,))
+        deleted = cursor.rowcount
+
+        conn.commit()
+        exercise_catalog.load(conn)
+        response_cache.invalidate("exercises", "workouts-expand:exercises", *(f"workout-exercises:{workout_id}" for workout_id in set(affected_workouts)))
+        return {"deleted": deleted, "workout_exercises_deleted": len(affected_workouts), "message": f"Удалено упражнений: {deleted}"}
+    except Exception as e:
+        conn.rollback()
+        return {"error": f"Ошибка пакетного удаления упражнений: {str(e)}"}
+
+@app.put("/exercises/bulk")
+@sqlite_only
+@db_write
+def update_exercises_bulk(conn: sqlite3.Connection, update: ExerciseBulkUpdate):
+    """Изменение упражнений по списку id и/или группе мышц одним UPDATE"""
+    where, params = update.where()
+    if not where:
+        return {"error": "Не заданы ни id, ни фильтры"}
+    fields = changed_fields(**update.changes.model_dump())
+    if not fields:
+        return {"error": "Нет данных для обновления"}
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"UPDATE Exercises SET {', '.join(f'{field} = ?' for field in fields)} WHERE {where} RETURNING exercise_id",
+            (*fields.values(), *params)
+        )
+        exercise_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT DISTINCT workout_id FROM WorkoutExercises WHERE exercise_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(exercise_ids),)
+        )
+        affected_workouts = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        exercise_catalog.load(conn)
+        response_cache.invalidate("exercises", "workouts-expand:exercises", *(f"workout-exercises:{workout_id}" for workout_id in affected_workouts))
+        return {"updated": len(exercise_ids), "message": f"Обновлено упражнений: {len(exercise_ids)}"}
+    except Exception as e:
+        conn.rollback()
+        return {"error": f"Ошибка пакетного изменения упражнений: {str(e)}"}
+
+@app.get("/exercises/")
+@cached("exercises")
+@db_read
+def get_exercises(conn: sqlite3.Connection, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), page_cursor: str = Query(None, alias="cursor"), muscle_group: str = None):
+    """Получить упражнения постранично (из справочника в памяти)"""
+    last_id = None
+    if page_cursor is not None:
+        try:
+            last_id, = decode_cursor(page_cursor, 1)
+        except ValueError as e:
+            return {"error": str(e)}
+        if not isinstance(last_id, int):
+            return {"error": "Некорректный курсор"}
+
+    page = exercise_catalog.snapshot(conn).page(last_id, limit + 1, muscle_group)
+    exercises, next_cursor = split_page(page, limit, lambda e: (e.exercise_id,))
     
     if not exercises:
         return {"error": "Список упражнений пуст"}
     
-    return [{
-        "exercise_id": e[0], 
-        "name": e[1], 
-        "description": e[2], 
-        "muscle_group": e[3]
-    } for e in exercises]
+    return page_response([e.as_dict() for e in exercises], next_cursor)
 
 @app.put("/exercises/{exercise_id}")
-def update_exercise(exercise_id: int, name: str = None, description: str = None, muscle_group: str = None):
-    """Обновление упражнения"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
+@db_write
+def update_exercise(conn: sqlite3.Connection, exercise_id: int, name: str = None, description: str = None, muscle_group: str = None, returning: bool = False):
+    """Обновление упражнения (returning=true - вернуть обновленную строку)"""
+    fields = changed_fields(name=name, description=description, muscle_group=muscle_group)
+    if not fields:
+        return {"error": "Нет данных для обновления"}
     try:
-        # Проверяем существование упражнения
-        cursor.execute("SELECT * FROM Exercises WHERE exercise_id = ?", (exercise_id,))
-        exercise = cursor.fetchone()
-        
-        if not exercise:
+        exercise = exercise_repository.update(conn, exercise_id, fields, ("*",) if returning else ())
+        if exercise is None:
             return {"error": "Упражнение не найдено"}
         
-        # Собираем поля для обновления
-        update_fields = []
-        update_values = []
-        
-        if name is not None:
-            update_fields.append("name = ?")
-            update_values.append(name)
-        if description is not None:
-            update_fields.append("description = ?")
-            update_values.append(description)
-        if muscle_group is not None:
-            update_fields.append("muscle_group = ?")
-            update_values.append(muscle_group)
-        
-        if not update_fields:
-            return {"error": "Нет данных для обновления"}
-        
-        update_values.append(exercise_id)
-        query = f"UPDATE Exercises SET {', '.join(update_fields)} WHERE exercise_id = ?"
-        
-        cursor.execute(query, update_values)
+        affected_workouts = workout_exercise_repository.workouts_with_exercise(conn, exercise_id)
         conn.commit()
+        exercise_catalog.load(conn)
+        response_cache.invalidate("exercises", "workouts-expand:exercises", *(f"workout-exercises:{workout_id}" for workout_id in affected_workouts))
         
+        if returning:
+            return {"message": "Упражнение обновлено", "exercise": exercise}
         return {"message": "Упражнение обновлено"}
     except Exception as e:
         return {"error": f"Ошибка обновления упражнения: {str(e)}"}
-    finally:
-        conn.close()
 
 # Прогресс
 @app.post("/progress/")
-def create_progress(date: str, weight: float = None, height: float = None, body_fat_percentage: float = None, muscle_mass: float = None, notes: str = ""):
-    """Создание записи прогресса"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
+@write_behind(progress_repository, "progress", "stats:progress", "stats:timeseries")
+@db_write
+def create_progress(conn: sqlite3.Connection, date: str, weight: float = None, height: float = None, body_fat_percentage: float = None, muscle_mass: float = None, notes: str = "",
+                    idempotency_key: Optional[str] = Header(None, max_length=IDEMPOTENCY_KEY_MAX_LENGTH)):
+    """Создание записи прогресса; повтор с тем же заголовком Idempotency-Key возвращает первый ответ"""
+    values = dict(date=date, weight=weight, height=height, body_fat_percentage=body_fat_percentage,
+                  muscle_mass=muscle_mass, notes=notes)
+    replay = idempotency_store.replay(conn, "progress", idempotency_key, values)
+    if replay is not None:
+        return replay
     try:
-        cursor.execute(
-            "INSERT INTO Progress (date, weight, height, body_fat_percentage, muscle_mass, notes) VALUES (?, ?, ?, ?, ?, ?)",
-            (date, weight, height, body_fat_percentage, muscle_mass, notes)
-        )
+        progress_id = progress_repository.create(conn, **values)
+        response = {"progress_id": progress_id, "message": "Запись прогресса создана"}
+        idempotency_store.remember(conn, "progress", idempotency_key, values, response)
         conn.commit()
-        progress_id = cursor.lastrowid
-        return {"progress_id": progress_id, "message": "Запись прогресса создана"}
+        response_cache.invalidate("progress", "stats:progress", "stats:timeseries")
+        return response
     except Exception as e:
         return {"error": f"Ошибка создания записи прогресса: {str(e)}"}
-    finally:
-        conn.close()
+
+class ProgressFilter(BaseModel):
+    ids: Optional[List[int]] = Field(None, max_length=MAX_BULK_IDS)
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+
+    def where(self):
+        return where_clause("progress_id", self.ids, [("date >= ?", self.date_from), ("date <= ?", self.date_to)])
+
+
+class ProgressChanges(BaseModel):
+    date: Optional[str] = None
+    weight: Optional[float] = None
+    height: Optional[float] = None
+    body_fat_percentage: Optional[float] = None
+    muscle_mass: Optional[float] = None
+    notes: Optional[str] = None
+
+
+class ProgressBulkUpdate(ProgressFilter):
+    changes: ProgressChanges
+
+
+@app.delete("/progress/bulk")
+@sqlite_only
+@db_write
+def delete_progress_bulk(conn: sqlite3.Connection, selection: ProgressFilter):
+    """Удаление записей прогресса по списку id и/или периоду одним DELETE"""
+    where, params = selection.where()
+    if not where:
+        return {"error": "Не заданы ни id, ни фильтры"}
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DELETE FROM Progress WHERE {where}", params)
+        deleted = cursor.rowcount
+        conn.commit()
+        response_cache.invalidate("progress", "stats:progress", "stats:timeseries")
+        return {"deleted": deleted, "message": f"Удалено записей прогресса: {deleted}"}
+    except Exception as e:
+        conn.rollback()
+        return {"error": f"Ошибка пакетного удаления записей прогресса: {str(e)}"}
+
+@app.put("/progress/bulk")
+@sqlite_only
+@db_write
+def update_progress_bulk(conn: sqlite3.Connection, update: ProgressBulkUpdate):
+    """Изменение записей прогресса по списку id и/или периоду одним UPDATE"""
+    where, params = update.where()
+    if not where:
+        return {"error": "Не заданы ни id, ни фильтры"}
+    fields = changed_fields(**update.changes.model_dump())
+    if not fields:
+        return {"error": "Нет данных для обновления"}
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"UPDATE Progress SET {', '.join(f'{field} = ?' for field in fields)} WHERE {where}", (*fields.values(), *params))
+        updated = cursor.rowcount
+        conn.commit()
+        response_cache.invalidate("progress", "stats:progress", "stats:timeseries")
+        return {"updated": updated, "message": f"Обновлено записей прогресса: {updated}"}
+    except Exception as e:
+        conn.rollback()
+        return {"error": f"Ошибка пакетного изменения записей прогресса: {str(e)}"}
+
+PROGRESS_COLUMNS = ("progress_id", "date", "weight", "height", "body_fat_percentage", "muscle_mass", "notes")
+PROGRESS_SORT_FIELDS = {"date", "progress_id"}
 
 @app.get("/progress/")
-def get_progress():
-    """Получить все записи прогресса"""
-    conn = sqlite3.connect("fitness_tracker.db")
+@sqlite_only
+@cached("progress")
+@db_read
+def get_progress(
+    conn: sqlite3.Connection,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    page_cursor: str = Query(None, alias="cursor"),
+    date_from: str = None,
+    date_to: str = None,
+    min_weight: float = None,
+    max_weight: float = None,
+    sort: str = "date",
+    order: str = "desc"
+):
+    """Получить записи прогресса постранично с фильтрами (по умолчанию от новых к старым)"""
+    if sort not in PROGRESS_SORT_FIELDS:
+        return {"error": f"Сортировка по полю {sort} недоступна"}
+    if order not in SORT_DIRECTIONS:
+        return {"error": f"Неизвестное направление сортировки: {order}"}
+
+    where, params = where_clause("progress_id", None, [
+        ("date >= ?", date_from),
+        ("date <= ?", date_to),
+        ("weight >= ?", min_weight),
+        ("weight <= ?", max_weight),
+    ])
+    try:
+        after, after_params, order_by = keyset(sort, "progress_id", order, page_cursor)
+    except ValueError as e:
+        return {"error": str(e)}
+    conditions = [c for c in (where, after) if c]
+    query = f"SELECT {', '.join(PROGRESS_COLUMNS)} FROM Progress"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    query += f" ORDER BY {order_by} LIMIT ?"
+    params += after_params
+    params.append(limit + 1)
+
+    sort_index = PROGRESS_COLUMNS.index(sort)
     cursor = conn.cursor()
-    cursor.execute("SELECT progress_id, date, weight, height, body_fat_percentage, muscle_mass, notes FROM Progress ORDER BY date DESC")
-    progress_entries = cursor.fetchall()
-    conn.close()
+    cursor.execute(query, params)
+    progress_entries, next_cursor = split_page(cursor.fetchall(), limit, lambda p: (p[sort_index], p[0]))
     
     if not progress_entries:
         return {"error": "Список записей прогресса пуст"}
     
-    return [{
-        "progress_id": p[0], 
-        "date": p[1], 
-        "weight": p[2], 
-        "height": p[3], 
-        "body_fat_percentage": p[4], 
-        "muscle_mass": p[5], 
-        "notes": p[6]
-    } for p in progress_entries]
+    return page_response(rows_as_dicts(PROGRESS_COLUMNS, progress_entries), next_cursor)
 
 @app.put("/progress/{progress_id}")
-def update_progress(progress_id: int, date: str = None, weight: float = None, height: float = None, body_fat_percentage: float = None, muscle_mass: float = None, notes: str = None):
-    """Обновление записи прогресса"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
+@db_write
+def update_progress(conn: sqlite3.Connection, progress_id: int, date: str = None, weight: float = None, height: float = None, body_fat_percentage: float = None, muscle_mass: float = None, notes: str = None, returning: bool = False):
+    """Обновление записи прогресса (returning=true - вернуть обновленную строку)"""
+    fields = changed_fields(date=date, weight=weight, height=height, body_fat_percentage=body_fat_percentage, muscle_mass=muscle_mass, notes=notes)
+    if not fields:
+        return {"error": "Нет данных для обновления"}
     try:
-        # Проверяем существование записи прогресса
-        cursor.execute("SELECT * FROM Progress WHERE progress_id = ?", (progress_id,))
-        progress = cursor.fetchone()
-        
-        if not progress:
+        progress = progress_repository.update(conn, progress_id, fields, ("*",) if returning else ())
+        if progress is None:
             return {"error": "Запись прогресса не найдена"}
-        
-        # Собираем поля для обновления
-        update_fields = []
-        update_values = []
-        
-        if date is not None:
-            update_fields.append("date = ?")
-            update_values.append(date)
-        if weight is not None:
-            update_fields.append("weight = ?")
-            update_values.append(weight)
-        if height is not None:
-            update_fields.append("height = ?")
-            update_values.append(height)
-        if body_fat_percentage is not None:
-            update_fields.append("body_fat_percentage = ?")
-            update_values.append(body_fat_percentage)
-        if muscle_mass is not None:
-            update_fields.append("muscle_mass = ?")
-            update_values.append(muscle_mass)
-        if notes is not None:
-            update_fields.append("notes = ?")
-            update_values.append(notes)
-        
-        if not update_fields:
-            return {"error": "Нет данных для обновления"}
-        
-        update_values.append(progress_id)
-        query = f"UPDATE Progress SET {', '.join(update_fields)} WHERE progress_id = ?"
-        
-        cursor.execute(query, update_values)
         conn.commit()
+        response_cache.invalidate("progress", "stats:progress", "stats:timeseries")
         
+        if returning:
+            return {"message": "Запись прогресса обновлена", "progress": progress}
         return {"message": "Запись прогресса обновлена"}
     except Exception as e:
         return {"error": f"Ошибка обновления записи прогресса: {str(e)}"}
-    finally:
-        conn.close()
 
 # Упражнения в тренировках
 @app.post("/workout-exercises/")
-def create_workout_exercise(workout_id: int, exercise_id: int, sets: int = None, reps: int = None, weight_kg: float = None, duration_seconds: int = None):
+@write_behind(workout_exercise_repository, "workouts-expand:exercises", "workout-exercises:{workout_id}")
+@db_write
+def create_workout_exercise(conn: sqlite3.Connection, workout_id: int, exercise_id: int, sets: int = None, reps: int = None, weight_kg: float = None, duration_seconds: int = None):
     """Добавление упражнения в тренировку"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
+    # Упражнение могли создать в другом процессе после загрузки справочника: перед отказом перечитываем его
+    if exercise_catalog.missing(conn, [exercise_id]):
+        return {"error": "Упражнение не найдено"}
     try:
-        # Проверяем существование тренировки и упражнения
-        cursor.execute("SELECT 1 FROM Workouts WHERE workout_id = ?", (workout_id,))
-        workout = cursor.fetchone()
-        
-        cursor.execute("SELECT 1 FROM Exercises WHERE exercise_id = ?", (exercise_id,))
-        exercise = cursor.fetchone()
-        
-        if not workout or not exercise:
-            return {"error": "Тренировка или упражнение не найдены"}
-        
-        cursor.execute(
-            "INSERT INTO WorkoutExercises (workout_id, exercise_id, sets, reps, weight_kg, duration_seconds) VALUES (?, ?, ?, ?, ?, ?)",
-            (workout_id, exercise_id, sets, reps, weight_kg, duration_seconds)
+        # Существование тренировки проверяет внешний ключ
+        workout_exercise_id = workout_exercise_repository.create(
+            conn, workout_id=workout_id, exercise_id=exercise_id, sets=sets, reps=reps,
+            weight_kg=weight_kg, duration_seconds=duration_seconds
         )
-        
         conn.commit()
-        workout_exercise_id = cursor.lastrowid
+        response_cache.invalidate("workouts-expand:exercises", f"workout-exercises:{workout_id}")
         return {"workout_exercise_id": workout_exercise_id, "message": "Упражнение добавлено в тренировку"}
+    except INTEGRITY_ERRORS:
+        return {"error": "Тренировка не найдена"}
     except Exception as e:
         return {"error": f"Ошибка добавления упражнения: {str(e)}"}
-    finally:
-        conn.close()
 
 @app.get("/workout-exercises/{workout_id}")
-def get_workout_exercises(workout_id: int):
+@cached("workout-exercises:{workout_id}")
+@db_read
+def get_workout_exercises(conn: sqlite3.Connection, workout_id: int):
     """Получить все упражнения для конкретной тренировки"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT we.workout_exercise_id, e.name, e.muscle_group, we.sets, we.reps, we.weight_kg, we.duration_seconds
-        FROM WorkoutExercises we
-        JOIN Exercises e ON we.exercise_id = e.exercise_id
-        WHERE we.workout_id = ?
-    ''', (workout_id,))
-    exercises = cursor.fetchall()
-    conn.close()
+    # Название и группа мышц берутся из справочника в памяти вместо JOIN Exercises
+    exercises = exercise_catalog.join(conn, workout_exercise_repository.for_workout(conn, workout_id), 1)
     
     if not exercises:
         return {"error": "В этой тренировке нет упражнений"}
     
-    return [{
-        "workout_exercise_id": e[0],
-        "exercise_name": e[1],
-        "muscle_group": e[2],
-        "sets": e[3],
-        "reps": e[4],
-        "weight_kg": e[5],
-        "duration_seconds": e[6]
-    } for e in exercises]
+    return FastJSONResponse(rows_as_dicts(WORKOUT_EXERCISE_FIELDS, exercises))
 
 @app.put("/workout-exercises/{workout_exercise_id}")
-def update_workout_exercise(workout_exercise_id: int, sets: int = None, reps: int = None, weight_kg: float = None, duration_seconds: int = None):
-    """Обновление упражнения в тренировке"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
+@db_write
+def update_workout_exercise(conn: sqlite3.Connection, workout_exercise_id: int, sets: int = None, reps: int = None, weight_kg: float = None, duration_seconds: int = None, returning: bool = False):
+    """Обновление упражнения в тренировке (returning=true - вернуть обновленную строку)"""
+    fields = changed_fields(sets=sets, reps=reps, weight_kg=weight_kg, duration_seconds=duration_seconds)
+    if not fields:
+        return {"error": "Нет данных для обновления"}
     try:
-        # Проверяем существование записи
-        cursor.execute("SELECT * FROM WorkoutExercises WHERE workout_exercise_id = ?", (workout_exercise_id,))
-        workout_exercise = cursor.fetchone()
-        
-        if not workout_exercise:
+        # workout_id нужен всегда: по нему сбрасывается кэш списка упражнений тренировки
+        workout_exercise = workout_exercise_repository.update(conn, workout_exercise_id, fields, ("*",) if returning else ("workout_id",))
+        if workout_exercise is None:
             return {"error": "Запись упражнения в тренировке не найдена"}
-        
-        # Собираем поля для обновления
-        update_fields = []
-        update_values = []
-        
-        if sets is not None:
-            update_fields.append("sets = ?")
-            update_values.append(sets)
-        if reps is not None:
-            update_fields.append("reps = ?")
-            update_values.append(reps)
-        if weight_kg is not None:
-            update_fields.append("weight_kg = ?")
-            update_values.append(weight_kg)
-        if duration_seconds is not None:
-            update_fields.append("duration_seconds = ?")
-            update_values.append(duration_seconds)
-        
-        if not update_fields:
-            return {"error": "Нет данных для обновления"}
-        
-        update_values.append(workout_exercise_id)
-        query = f"UPDATE WorkoutExercises SET {', '.join(update_fields)} WHERE workout_exercise_id = ?"
-        
-        cursor.execute(query, update_values)
         conn.commit()
+        response_cache.invalidate("workouts-expand:exercises", f"workout-exercises:{workout_exercise['workout_id']}")
         
+        if returning:
+            return {"message": "Упражнение в тренировке обновлено", "workout_exercise": workout_exercise}
         return {"message": "Упражнение в тренировке обновлено"}
     except Exception as e:
         return {"error": f"Ошибка обновления упражнения в тренировке: {str(e)}"}
-    finally:
-        conn.close()
 
 # Статистика
 @app.get("/stats/workouts")
-def get_workout_stats():
+@sqlite_only
+@cached("stats:workouts")
+@db_snapshot
+def get_workout_stats(conn: sqlite3.Connection):
     """Получить статистику по тренировкам"""
-    conn = sqlite3.connect("fitness_tracker.db")
     cursor = conn.cursor()
     
-    # Общее количество тренировок
-    cursor.execute("SELECT COUNT(*) FROM Workouts")
-    total_workouts = cursor.fetchone()[0]
-    
-    # Общее время тренировок (минуты)
-    cursor.execute("SELECT SUM(duration_minutes) FROM Workouts")
-    total_minutes = cursor.fetchone()[0] or 0
-    
-    # Общее количество сожженных калорий
-    cursor.execute("SELECT SUM(calories_burned) FROM Workouts WHERE calories_burned IS NOT NULL")
-    total_calories = cursor.fetchone()[0] or 0
-    
-    # Количество тренировок по типам
-    cursor.execute("SELECT workout_type, COUNT(*) FROM Workouts GROUP BY workout_type")
+    # Агрегаты поддерживаются триггерами при каждой записи в Workouts,
+    # поэтому здесь читается одна строка на тип тренировки, а не вся таблица
+    cursor.execute("SELECT workout_type, workout_count, total_minutes, total_calories FROM WorkoutTypeStats")
     workouts_by_type = cursor.fetchall()
     
-    conn.close()
-    
     return {
-        "total_workouts": total_workouts,
-        "total_minutes": total_minutes,
-        "total_calories": total_calories,
+        "total_workouts": sum(w[1] for w in workouts_by_type),
+        "total_minutes": sum(w[2] for w in workouts_by_type),
+        "total_calories": sum(w[3] for w in workouts_by_type),
         "workouts_by_type": [{"type": w[0], "count": w[1]} for w in workouts_by_type]
     }
 
 @app.get("/stats/progress")
-def get_progress_stats():
+@sqlite_only
+@cached("stats:progress")
+@db_snapshot
+def get_progress_stats(conn: sqlite3.Connection):
     """Получить статистику прогресса"""
-    conn = sqlite3.connect("fitness_tracker.db")
     cursor = conn.cursor()
     
     # Последние записи веса
@@ -468,82 +729,213 @@ def get_progress_stats():
     cursor.execute("SELECT date, muscle_mass FROM Progress WHERE muscle_mass IS NOT NULL ORDER BY date DESC LIMIT 10")
     muscle_history = cursor.fetchall()
     
-    conn.close()
     
     return {
         "weight_history": [{"date": w[0], "weight": w[1]} for w in weight_history],
         "muscle_mass_history": [{"date": m[0], "muscle_mass": m[1]} for m in muscle_history]
     }
 
+# Группировка дневных агрегатов в интервалы: день, неделя (с понедельника), месяц
+TIMESERIES_BUCKETS = {
+    "day": "day",
+    "week": "date(day, 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m', day)",
+}
+
+@app.get("/stats/timeseries")
+@sqlite_only
+@cached("stats:timeseries")
+@db_snapshot
+def get_timeseries_stats(conn: sqlite3.Connection, bucket: str = "day", date_from: str = None, date_to: str = None):
+    """Статистика тренировок и прогресса по дням, неделям или месяцам"""
+    if bucket not in TIMESERIES_BUCKETS:
+        return {"error": f"Неизвестный интервал: {bucket}"}
+
+    # Читаются только дневные агрегаты за период, а не исходные строки тренировок
+    conditions = []
+    params = []
+    if date_from is not None:
+        conditions.append("day >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append("day <= ?")
+        params.append(date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    bucket_expr = TIMESERIES_BUCKETS[bucket]
+
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT {bucket_expr} AS bucket, workout_type, SUM(workout_count), SUM(total_minutes), SUM(total_calories)
+        FROM WorkoutDailyStats {where}
+        GROUP BY bucket, workout_type
+    ''', params)
+    workout_rows = cursor.fetchall()
+
+    cursor.execute(f'''
+        SELECT {bucket_expr} AS bucket,
+               SUM(weight_sum) / NULLIF(SUM(weight_count), 0),
+               SUM(body_fat_sum) / NULLIF(SUM(body_fat_count), 0),
+               SUM(muscle_mass_sum) / NULLIF(SUM(muscle_mass_count), 0)
+        FROM ProgressDailyStats {where}
+        GROUP BY bucket
+    ''', params)
+    progress_rows = cursor.fetchall()
+
+    def empty_bucket(key):
+        return {
+            "bucket": key,
+            "workout_count": 0,
+            "total_minutes": 0,
+            "total_calories": 0,
+            "workouts_by_type": [],
+            "avg_weight": None,
+            "avg_body_fat_percentage": None,
+            "avg_muscle_mass": None
+        }
+
+    buckets = {}
+    for key, workout_type, count, minutes, calories in workout_rows:
+        item = buckets.setdefault(key, empty_bucket(key))
+        item["workout_count"] += count
+        item["total_minutes"] += minutes
+        item["total_calories"] += calories
+        item["workouts_by_type"].append({"type": workout_type, "count": count})
+    for key, weight, body_fat, muscle_mass in progress_rows:
+        item = buckets.setdefault(key, empty_bucket(key))
+        item["avg_weight"] = weight
+        item["avg_body_fat_percentage"] = body_fat
+        item["avg_muscle_mass"] = muscle_mass
+
+    # Даты, которые не удалось разобрать, попадают в интервал None - их не показываем
+    return {
+        "bucket": bucket,
+        "series": [buckets[key] for key in sorted(k for k in buckets if k is not None)]
+    }
+
+# Полнотекстовый поиск
+@app.get("/search")
+@sqlite_only
+@db_read
+def search_all(conn: sqlite3.Connection, q: str, scope: str = None, limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT), prefix: bool = True, exact: bool = False):
+    """Поиск по названиям и заметкам тренировок, упражнениям и заметкам прогресса
+
+    scope - области через запятую (workouts, exercises, progress), по умолчанию все;
+    prefix=true - последнее слово ищется как начало слова;
+    exact=true - ранжировать все совпадения, а не только последние SEARCH_CANDIDATES (медленнее для частых слов).
+    """
+    scopes = scope.split(",") if scope else list(SEARCH_SCOPES)
+    unknown = [name for name in scopes if name not in SEARCH_SCOPES]
+    if unknown:
+        return {"error": f"Неизвестная область поиска: {', '.join(unknown)}"}
+    match = build_match(q, prefix)
+    if match is None:
+        return {"error": "Пустой поисковый запрос"}
+    candidates = None if exact else SEARCH_CANDIDATES
+    return FastJSONResponse({"query": q, "results": search(conn, match, scopes, limit, candidates)})
+
 # Удаление тренировки
 @app.delete("/workouts/{workout_id}")
-def delete_workout(workout_id: int):
+@db_write
+def delete_workout(conn: sqlite3.Connection, workout_id: int):
     """Удаление тренировки"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
     try:
-        # Сначала удаляем связанные упражнения
-        cursor.execute("DELETE FROM WorkoutExercises WHERE workout_id = ?", (workout_id,))
-        
-        # Затем удаляем саму тренировку
-        cursor.execute("DELETE FROM Workouts WHERE workout_id = ?", (workout_id,))
-        
+        # Упражнения тренировки удаляются каскадно (ON DELETE CASCADE)
+        workout_repository.delete(conn, workout_id)
         conn.commit()
+        response_cache.invalidate("workouts", "stats:workouts", "stats:timeseries", f"workout-exercises:{workout_id}")
         return {"message": "Тренировка удалена"}
     except Exception as e:
         return {"error": f"Ошибка удаления тренировки: {str(e)}"}
-    finally:
-        conn.close()
 
 # Удаление упражнения
 @app.delete("/exercises/{exercise_id}")
-def delete_exercise(exercise_id: int):
+@db_write
+def delete_exercise(conn: sqlite3.Connection, exercise_id: int):
     """Удаление упражнения"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
     try:
-        # Сначала удаляем связанные записи в тренировках
-        cursor.execute("DELETE FROM WorkoutExercises WHERE exercise_id = ?", (exercise_id,))
-        
-        # Затем удаляем само упражнение
-        cursor.execute("DELETE FROM Exercises WHERE exercise_id = ?", (exercise_id,))
-        
+        # Записи в тренировках удаляются каскадно; их тренировки нужны только для сброса кэша
+        affected_workouts = workout_exercise_repository.workouts_with_exercise(conn, exercise_id)
+        exercise_repository.delete(conn, exercise_id)
         conn.commit()
+        exercise_catalog.load(conn)
+        response_cache.invalidate("exercises", "workouts-expand:exercises", *(f"workout-exercises:{workout_id}" for workout_id in affected_workouts))
         return {"message": "Упражнение удалено"}
     except Exception as e:
         return {"error": f"Ошибка удаления упражнения: {str(e)}"}
-    finally:
-        conn.close()
 
 # Удаление записи прогресса
 @app.delete("/progress/{progress_id}")
-def delete_progress(progress_id: int):
+@db_write
+def delete_progress(conn: sqlite3.Connection, progress_id: int):
     """Удаление записи прогресса"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM Progress WHERE progress_id = ?", (progress_id,))
+        progress_repository.delete(conn, progress_id)
         conn.commit()
+        response_cache.invalidate("progress", "stats:progress", "stats:timeseries")
         return {"message": "Запись прогресса удалена"}
     except Exception as e:
         return {"error": f"Ошибка удаления записи прогресса: {str(e)}"}
-    finally:
-        conn.close()
 
 # Удаление упражнения из тренировки
 @app.delete("/workout-exercises/{workout_exercise_id}")
-def delete_workout_exercise(workout_exercise_id: int):
+@db_write
+def delete_workout_exercise(conn: sqlite3.Connection, workout_exercise_id: int):
     """Удаление упражнения из тренировки"""
-    conn = sqlite3.connect("fitness_tracker.db")
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM WorkoutExercises WHERE workout_exercise_id = ?", (workout_exercise_id,))
+        deleted = workout_exercise_repository.delete(conn, workout_exercise_id, ("workout_id",))
         conn.commit()
+        if deleted is not None:
+            response_cache.invalidate("workouts-expand:exercises", f"workout-exercises:{deleted['workout_id']}")
         return {"message": "Упражнение удалено из тренировки"}
     except Exception as e:
         return {"error": f"Ошибка удаления упражнения из тренировки: {str(e)}"}
-    finally:
-        conn.close()
+
+# Кэш ответов
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Счетчики кэша ответов: попадания, промахи, вытеснения"""
+    return response_cache.stats()
+
+# Очередь отложенной записи
+@app.get("/ingest/stats")
+async def get_ingest_stats():
+    """Состояние очереди отложенной записи: длина, число пачек и записанных строк"""
+    return ingest_queue.stats()
+
+@app.get("/ingest/{token}")
+async def get_ingest_status(token: int):
+    """Записана ли строка, принятая в очередь с этим токеном"""
+    return ingest_queue.status(token)
+
+# Снимок базы для аналитики
+@app.get("/snapshot/stats")
+async def get_snapshot_stats():
+    """Состояние снимка базы: включен ли, сколько раз обновлялся, возраст данных"""
+    return snapshot_replica.stats()
+
+# Метрики
+@app.get("/metrics")
+async def get_metrics():
+    """Задержки по маршрутам и статистика SQL в текстовом формате Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Экспорт
+@app.get("/export/{table}")
+@sqlite_only
+async def export_table(table: str, format: str = "ndjson"):
+    """Потоковая выгрузка всей таблицы в NDJSON или CSV"""
+    if table not in EXPORT_TABLES:
+        return {"error": f"Неизвестная таблица: {table}"}
+    if format not in EXPORT_FORMATS:
+        return {"error": f"Неизвестный формат: {format}"}
+
+    table_name, columns = EXPORT_TABLES[table]
+    # Пул берется сейчас: генератор дочитывается уже после выхода из контекста запроса
+    return StreamingResponse(
+        STREAMERS[format](active_pool(), table_name, columns),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'}
+    )
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,272 @@
+import bisect
+import contextvars
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+# Трассировка SQL: FITNESS_SQL_TRACE=0 отключает обертку соединений
+SQL_TRACE = os.environ.get("FITNESS_SQL_TRACE", "1") != "0"
+# Запросы дольше этого порога (мс) пишутся в лог вместе с параметрами
+SLOW_QUERY_MS = float(os.environ.get("FITNESS_SLOW_QUERY_MS", "100"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+# Маршрут для запросов, которые не совпали ни с одним эндпоинтом:
+# сырой путь в метку не пишем, иначе число рядов метрики не ограничено
+UNMATCHED_ROUTE = "<unmatched>"
+# Метка для запросов к базе вне HTTP-запроса: миграции, прогрев пула, фоновые задачи
+BACKGROUND_ROUTE = "<background>"
+
+slow_query_log = logging.getLogger("fitness.sql")
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: накопительные бакеты, сумма и число наблюдений"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """Метрики процесса; пишутся из цикла событий и из потоков базы"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: defaultdict(float))  # имя -> метки -> значение
+        self._histograms = defaultdict(dict)  # имя -> метки -> Histogram
+        self._help = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._counters[name][labels] += value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self._histograms[name].get(labels)
+            if histogram is None:
+                histogram = self._histograms[name][labels] = Histogram(buckets)
+            histogram.observe(value)
+
+    def sums(self, name):
+        """Сумма наблюдений гистограммы name для каждого набора меток"""
+        with self._lock:
+            return {labels: histogram.sum for labels, histogram in self._histograms.get(name, {}).items()}
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """Текстовый формат Prometheus 0.0.4"""
+        lines = []
+        with self._lock:
+            for name in sorted(set(self._counters) | set(self._histograms)):
+                if name in self._help:
+                    kind, text = self._help[name]
+                    lines.append(f"# HELP {name} {text}")
+                    lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(self._counters.get(name, {}).items()):
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                for labels, histogram in sorted(self._histograms.get(name, {}).items()):
+                    total = 0
+                    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                        total += count
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {total}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(histogram.sum)}")
+                    lines.append(f"{name}_count{_labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+registry = Registry()
+registry.describe("http_requests_total", "counter", "Число HTTP-запросов")
+registry.describe("http_request_duration_seconds", "histogram", "Время обработки HTTP-запроса")
+registry.describe("http_request_sql_queries", "histogram", "Число SQL-запросов на один HTTP-запрос")
+registry.describe("http_request_sql_duration_seconds", "histogram", "Суммарное время SQL за один HTTP-запрос")
+registry.describe("sqlite_query_duration_seconds", "histogram", "Время выполнения одного SQL-запроса с выборкой строк")
+registry.describe("sqlite_slow_queries_total", "counter", "Число SQL-запросов дольше порога FITNESS_SLOW_QUERY_MS")
+
+
+class RequestStats:
+    """Счетчики SQL текущего HTTP-запроса"""
+
+    __slots__ = ("scope", "queries", "sql_seconds")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+    @property
+    def route(self):
+        # Роутер записывает выбранный маршрут в scope перед вызовом обработчика
+        route = self.scope.get("route")
+        return route.path if route is not None else UNMATCHED_ROUTE
+
+
+# Статистика запроса передается в потоки базы через contextvars:
+# run_read/run_write запускают функции в копии контекста цикла событий
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Курсор, который меряет время каждого выражения вместе с выборкой его строк
+
+    Выражение считается завершенным, когда строки выбраны до конца,
+    курсор выполняет следующее выражение или удаляется.
+    """
+
+    _sql = None
+
+    def _start(self, sql, parameters):
+        self._finish()
+        self._sql = sql
+        self._parameters = parameters
+        self._elapsed = 0.0
+        self._stats = current_request.get()
+        if self._stats is not None:
+            self._stats.queries += 1
+
+    def _timed(self, call, *args):
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            if self._sql is not None:
+                self._elapsed += time.perf_counter() - start
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        sql, elapsed, stats = self._sql, self._elapsed, self._stats
+        self._sql = None
+        route = stats.route if stats is not None else BACKGROUND_ROUTE
+        if stats is not None:
+            stats.sql_seconds += elapsed
+        operation = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+        registry.observe("sqlite_query_duration_seconds", (("route", route), ("operation", operation)), elapsed)
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            registry.inc("sqlite_slow_queries_total", (("route", route),))
+            slow_query_log.warning("Медленный запрос (%.1f мс, %s): %s; параметры: %r",
+                                   elapsed * 1000, route, " ".join(sql.split()), self._parameters)
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Параметры executemany могут быть генератором: в лог попадает только число строк
+        if isinstance(seq_of_parameters, (list, tuple)):
+            self._start(sql, f"<{len(seq_of_parameters)} строк>")
+        else:
+            self._start(sql, "<итератор>")
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class TracedConnection(sqlite3.Connection):
+    """Соединение, все выражения которого идут через TracedCursor"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute в C не вызывает переопределенный cursor(), поэтому обходим его явно
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: время и число SQL-запросов для каждого маршрута
+
+    Маршрут берется из шаблона пути ("/workouts/{workout_id}"), а не из самого пути,
+    поэтому число рядов метрик не зависит от id в запросах.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            labels = (("method", scope["method"]), ("route", stats.route))
+            registry.inc("http_requests_total", labels + (("status", str(status)),))
+            registry.observe("http_request_duration_seconds", labels, elapsed)
+            registry.observe("http_request_sql_queries", labels, stats.queries, QUERY_COUNT_BUCKETS)
+            registry.observe("http_request_sql_duration_seconds", labels, stats.sql_seconds)
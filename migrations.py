@@ -0,0 +1,456 @@
+import sqlite3
+
+from database import DB_PATH, connect
+
+# Версия схемы хранится в PRAGMA user_version.
+# Каждая миграция: (версия, описание, SQL). Миграции применяются по порядку,
+# каждая в своей транзакции вместе с увеличением user_version.
+# Уже выпущенные миграции не редактируются - изменения схемы добавляются новой записью.
+MIGRATIONS = [
+    (1, "Базовые таблицы", '''
+        CREATE TABLE IF NOT EXISTS Workouts (
+            workout_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            workout_type TEXT NOT NULL,
+            duration_minutes INTEGER NOT NULL,
+            calories_burned INTEGER,
+            date DATE NOT NULL,
+            notes TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS Exercises (
+            exercise_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            muscle_group TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS Progress (
+            progress_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date DATE NOT NULL,
+            weight REAL,
+            height REAL,
+            body_fat_percentage REAL,
+            muscle_mass REAL,
+            notes TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS WorkoutExercises (
+            workout_exercise_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            workout_id INTEGER,
+            exercise_id INTEGER,
+            sets INTEGER,
+            reps INTEGER,
+            weight_kg REAL,
+            duration_seconds INTEGER
+        );
+    '''),
+    (2, "Индексы для сортировки по дате, связей и статистики", '''
+        -- get_workouts: ORDER BY date DESC (rowid = workout_id уже входит в индекс)
+        CREATE INDEX IF NOT EXISTS idx_workouts_date ON Workouts(date);
+
+        -- /stats/workouts: COUNT/SUM и GROUP BY workout_type только по индексу
+        CREATE INDEX IF NOT EXISTS idx_workouts_type_stats
+            ON Workouts(workout_type, duration_minutes, calories_burned);
+
+        -- get_progress и /stats/progress: сортировка по дате, история веса и мышечной массы по индексу
+        CREATE INDEX IF NOT EXISTS idx_progress_date_measures
+            ON Progress(date, weight, muscle_mass);
+
+        -- get_workout_exercises, delete_workout
+        CREATE INDEX IF NOT EXISTS idx_workout_exercises_workout ON WorkoutExercises(workout_id);
+
+        -- delete_exercise
+        CREATE INDEX IF NOT EXISTS idx_workout_exercises_exercise ON WorkoutExercises(exercise_id);
+
+        ANALYZE;
+    '''),
+    (3, "Индекс для постраничного вывода прогресса", '''
+        -- В idx_progress_date_measures после даты идут замеры, поэтому он не дает порядок (date, progress_id)
+        CREATE INDEX IF NOT EXISTS idx_progress_date ON Progress(date);
+
+        ANALYZE;
+    '''),
+    (4, "Агрегаты тренировок по типам для /stats/workouts", '''
+        CREATE TABLE IF NOT EXISTS WorkoutTypeStats (
+            workout_type TEXT PRIMARY KEY,
+            workout_count INTEGER NOT NULL,
+            total_minutes INTEGER NOT NULL,
+            total_calories INTEGER NOT NULL
+        ) WITHOUT ROWID;
+
+        INSERT INTO WorkoutTypeStats (workout_type, workout_count, total_minutes, total_calories)
+        SELECT workout_type, COUNT(*), IFNULL(SUM(duration_minutes), 0), IFNULL(SUM(calories_burned), 0)
+        FROM Workouts GROUP BY workout_type;
+
+        -- Триггеры применяют изменения к агрегатам в той же транзакции, что и запись в Workouts
+        CREATE TRIGGER IF NOT EXISTS trg_workouts_stats_insert AFTER INSERT ON Workouts
+        BEGIN
+            INSERT INTO WorkoutTypeStats (workout_type, workout_count, total_minutes, total_calories)
+            VALUES (NEW.workout_type, 1, IFNULL(NEW.duration_minutes, 0), IFNULL(NEW.calories_burned, 0))
+            ON CONFLICT(workout_type) DO UPDATE SET
+                workout_count = workout_count + 1,
+                total_minutes = total_minutes + excluded.total_minutes,
+                total_calories = total_calories + excluded.total_calories;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_workouts_stats_delete AFTER DELETE ON Workouts
+        BEGIN
+            UPDATE WorkoutTypeStats SET
+                workout_count = workout_count - 1,
+                total_minutes = total_minutes - IFNULL(OLD.duration_minutes, 0),
+                total_calories = total_calories - IFNULL(OLD.calories_burned, 0)
+            WHERE workout_type = OLD.workout_type;
+            DELETE FROM WorkoutTypeStats WHERE workout_type = OLD.workout_type AND workout_count <= 0;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_workouts_stats_update
+        AFTER UPDATE OF workout_type, duration_minutes, calories_burned ON Workouts
+        BEGIN
+            UPDATE WorkoutTypeStats SET
+                workout_count = workout_count - 1,
+                total_minutes = total_minutes - IFNULL(OLD.duration_minutes, 0),
+                total_calories = total_calories - IFNULL(OLD.calories_burned, 0)
+            WHERE workout_type = OLD.workout_type;
+            DELETE FROM WorkoutTypeStats WHERE workout_type = OLD.workout_type AND workout_count <= 0;
+            INSERT INTO WorkoutTypeStats (workout_type, workout_count, total_minutes, total_calories)
+            VALUES (NEW.workout_type, 1, IFNULL(NEW.duration_minutes, 0), IFNULL(NEW.calories_burned, 0))
+            ON CONFLICT(workout_type) DO UPDATE SET
+                workout_count = workout_count + 1,
+                total_minutes = total_minutes + excluded.total_minutes,
+                total_calories = total_calories + excluded.total_calories;
+        END;
+    '''),
+    (5, "Дневные агрегаты тренировок и прогресса для /stats/timeseries", '''
+        CREATE TABLE IF NOT EXISTS WorkoutDailyStats (
+            day TEXT NOT NULL,
+            workout_type TEXT NOT NULL,
+            workout_count INTEGER NOT NULL,
+            total_minutes INTEGER NOT NULL,
+            total_calories INTEGER NOT NULL,
+            PRIMARY KEY (day, workout_type)
+        ) WITHOUT ROWID;
+
+        -- Средние считаются при чтении как сумма / количество непустых значений
+        CREATE TABLE IF NOT EXISTS ProgressDailyStats (
+            day TEXT PRIMARY KEY,
+            entries INTEGER NOT NULL,
+            weight_sum REAL NOT NULL,
+            weight_count INTEGER NOT NULL,
+            body_fat_sum REAL NOT NULL,
+            body_fat_count INTEGER NOT NULL,
+            muscle_mass_sum REAL NOT NULL,
+            muscle_mass_count INTEGER NOT NULL
+        ) WITHOUT ROWID;
+
+        INSERT INTO WorkoutDailyStats (day, workout_type, workout_count, total_minutes, total_calories)
+        SELECT CAST(date AS TEXT), workout_type, COUNT(*), IFNULL(SUM(duration_minutes), 0), IFNULL(SUM(calories_burned), 0)
+        FROM Workouts GROUP BY date, workout_type;
+
+        INSERT INTO ProgressDailyStats
+        SELECT CAST(date AS TEXT), COUNT(*),
+               IFNULL(SUM(weight), 0), COUNT(weight),
+               IFNULL(SUM(body_fat_percentage), 0), COUNT(body_fat_percentage),
+               IFNULL(SUM(muscle_mass), 0), COUNT(muscle_mass)
+        FROM Progress GROUP BY date;
+
+        CREATE TRIGGER IF NOT EXISTS trg_workouts_daily_insert AFTER INSERT ON Workouts
+        BEGIN
+            INSERT INTO WorkoutDailyStats (day, workout_type, workout_count, total_minutes, total_calories)
+            VALUES (NEW.date, NEW.workout_type, 1, IFNULL(NEW.duration_minutes, 0), IFNULL(NEW.calories_burned, 0))
+            ON CONFLICT(day, workout_type) DO UPDATE SET
+                workout_count = workout_count + 1,
+                total_minutes = total_minutes + excluded.total_minutes,
+                total_calories = total_calories + excluded.total_calories;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_workouts_daily_delete AFTER DELETE ON Workouts
+        BEGIN
+            UPDATE WorkoutDailyStats SET
+                workout_count = workout_count - 1,
+                total_minutes = total_minutes - IFNULL(OLD.duration_minutes, 0),
+                total_calories = total_calories - IFNULL(OLD.calories_burned, 0)
+            WHERE day = OLD.date AND workout_type = OLD.workout_type;
+            DELETE FROM WorkoutDailyStats WHERE day = OLD.date AND workout_type = OLD.workout_type AND workout_count <= 0;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_workouts_daily_update
+        AFTER UPDATE OF workout_type, duration_minutes, calories_burned, date ON Workouts
+        BEGIN
+            UPDATE WorkoutDailyStats SET
+                workout_count = workout_count - 1,
+                total_minutes = total_minutes - IFNULL(OLD.duration_minutes, 0),
+                total_calories = total_calories - IFNULL(OLD.calories_burned, 0)
+            WHERE day = OLD.date AND workout_type = OLD.workout_type;
+            DELETE FROM WorkoutDailyStats WHERE day = OLD.date AND workout_type = OLD.workout_type AND workout_count <= 0;
+            INSERT INTO WorkoutDailyStats (day, workout_type, workout_count, total_minutes, total_calories)
+            VALUES (NEW.date, NEW.workout_type, 1, IFNULL(NEW.duration_minutes, 0), IFNULL(NEW.calories_burned, 0))
+            ON CONFLICT(day, workout_type) DO UPDATE SET
+                workout_count = workout_count + 1,
+                total_minutes = total_minutes + excluded.total_minutes,
+                total_calories = total_calories + excluded.total_calories;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_progress_daily_insert AFTER INSERT ON Progress
+        BEGIN
+            INSERT INTO ProgressDailyStats
+            VALUES (NEW.date, 1,
+                    IFNULL(NEW.weight, 0), NEW.weight IS NOT NULL,
+                    IFNULL(NEW.body_fat_percentage, 0), NEW.body_fat_percentage IS NOT NULL,
+                    IFNULL(NEW.muscle_mass, 0), NEW.muscle_mass IS NOT NULL)
+            ON CONFLICT(day) DO UPDATE SET
+                entries = entries + 1,
+                weight_sum = weight_sum + excluded.weight_sum,
+                weight_count = weight_count + excluded.weight_count,
+                body_fat_sum = body_fat_sum + excluded.body_fat_sum,
+                body_fat_count = body_fat_count + excluded.body_fat_count,
+                muscle_mass_sum = muscle_mass_sum + excluded.muscle_mass_sum,
+                muscle_mass_count = muscle_mass_count + excluded.muscle_mass_count;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_progress_daily_delete AFTER DELETE ON Progress
+        BEGIN
+            UPDATE ProgressDailyStats SET
+                entries = entries - 1,
+                weight_sum = weight_sum - IFNULL(OLD.weight, 0),
+                weight_count = weight_count - (OLD.weight IS NOT NULL),
+                body_fat_sum = body_fat_sum - IFNULL(OLD.body_fat_percentage, 0),
+                body_fat_count = body_fat_count - (OLD.body_fat_percentage IS NOT NULL),
+                muscle_mass_sum = muscle_mass_sum - IFNULL(OLD.muscle_mass, 0),
+                muscle_mass_count = muscle_mass_count - (OLD.muscle_mass IS NOT NULL)
+            WHERE day = OLD.date;
+            DELETE FROM ProgressDailyStats WHERE day = OLD.date AND entries <= 0;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_progress_daily_update
+        AFTER UPDATE OF date, weight, body_fat_percentage, muscle_mass ON Progress
+        BEGIN
+            UPDATE ProgressDailyStats SET
+                entries = entries - 1,
+                weight_sum = weight_sum - IFNULL(OLD.weight, 0),
+                weight_count = weight_count - (OLD.weight IS NOT NULL),
+                body_fat_sum = body_fat_sum - IFNULL(OLD.body_fat_percentage, 0),
+                body_fat_count = body_fat_count - (OLD.body_fat_percentage IS NOT NULL),
+                muscle_mass_sum = muscle_mass_sum - IFNULL(OLD.muscle_mass, 0),
+                muscle_mass_count = muscle_mass_count - (OLD.muscle_mass IS NOT NULL)
+            WHERE day = OLD.date;
+            DELETE FROM ProgressDailyStats WHERE day = OLD.date AND entries <= 0;
+            INSERT INTO ProgressDailyStats
+            VALUES (NEW.date, 1,
+                    IFNULL(NEW.weight, 0), NEW.weight IS NOT NULL,
+                    IFNULL(NEW.body_fat_percentage, 0), NEW.body_fat_percentage IS NOT NULL,
+                    IFNULL(NEW.muscle_mass, 0), NEW.muscle_mass IS NOT NULL)
+            ON CONFLICT(day) DO UPDATE SET
+                entries = entries + 1,
+                weight_sum = weight_sum + excluded.weight_sum,
+                weight_count = weight_count + excluded.weight_count,
+                body_fat_sum = body_fat_sum + excluded.body_fat_sum,
+                body_fat_count = body_fat_count + excluded.body_fat_count,
+                muscle_mass_sum = muscle_mass_sum + excluded.muscle_mass_sum,
+                muscle_mass_count = muscle_mass_count + excluded.muscle_mass_count;
+        END;
+    '''),
+    (6, "Внешние ключи WorkoutExercises с каскадным удалением", '''
+        -- SQLite не добавляет ограничения к существующей таблице: создаем новую и переносим строки.
+        -- Строки, ссылающиеся на удаленные тренировки или упражнения, не переносятся
+        CREATE TABLE WorkoutExercises_new (
+            workout_exercise_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            workout_id INTEGER NOT NULL REFERENCES Workouts(workout_id) ON DELETE CASCADE,
+            exercise_id INTEGER NOT NULL REFERENCES Exercises(exercise_id) ON DELETE CASCADE,
+            sets INTEGER,
+            reps INTEGER,
+            weight_kg REAL,
+            duration_seconds INTEGER
+        );
+
+        -- Счетчик AUTOINCREMENT переносится, чтобы id удаленных записей не выдавались повторно
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'WorkoutExercises_new', seq FROM sqlite_sequence WHERE name = 'WorkoutExercises';
+
+        INSERT INTO WorkoutExercises_new
+        SELECT workout_exercise_id, workout_id, exercise_id, sets, reps, weight_kg, duration_seconds
+        FROM WorkoutExercises
+        WHERE workout_id IN (SELECT workout_id FROM Workouts)
+          AND exercise_id IN (SELECT exercise_id FROM Exercises);
+
+        DROP TABLE WorkoutExercises;
+        ALTER TABLE WorkoutExercises_new RENAME TO WorkoutExercises;
+
+        -- Индексы по ссылкам нужны и для каскадного удаления: без них SQLite
+        -- просматривает всю WorkoutExercises при удалении каждой тренировки
+        CREATE INDEX idx_workout_exercises_workout ON WorkoutExercises(workout_id);
+        CREATE INDEX idx_workout_exercises_exercise ON WorkoutExercises(exercise_id);
+
+        ANALYZE WorkoutExercises;
+    '''),
+    (7, "Индексы для фильтров и сортировки списка тренировок", '''
+        -- get_workouts?workout_type=...: фильтр по типу и сортировка по дате без временного B-дерева
+        CREATE INDEX IF NOT EXISTS idx_workouts_type_date ON Workouts(workout_type, date);
+
+        -- get_workouts?sort=duration_minutes и фильтры min_duration/max_duration
+        CREATE INDEX IF NOT EXISTS idx_workouts_duration ON Workouts(duration_minutes);
+
+        ANALYZE Workouts;
+    '''),
+    (8, "Полнотекстовый поиск по тренировкам, упражнениям и прогрессу", '''
+        -- Индексы FTS5 без копии текста (content=...): текст берется из исходных таблиц.
+        -- unicode61 делит на слова и приводит к нижнему регистру и кириллицу ("ПРИСЕД" находит "приседания");
+        -- prefix='2 3' ускоряет поиск по началу слова ("прис*")
+        CREATE VIRTUAL TABLE WorkoutsSearch USING fts5(
+            title, notes,
+            content='Workouts', content_rowid='workout_id',
+            tokenize='unicode61', prefix='2 3'
+        );
+        CREATE VIRTUAL TABLE ExercisesSearch USING fts5(
+            name, description,
+            content='Exercises', content_rowid='exercise_id',
+            tokenize='unicode61', prefix='2 3'
+        );
+        CREATE VIRTUAL TABLE ProgressSearch USING fts5(
+            notes,
+            content='Progress', content_rowid='progress_id',
+            tokenize='unicode61', prefix='2 3'
+        );
+
+        INSERT INTO WorkoutsSearch (WorkoutsSearch) VALUES ('rebuild');
+        INSERT INTO ExercisesSearch (ExercisesSearch) VALUES ('rebuild');
+        INSERT INTO ProgressSearch (ProgressSearch) VALUES ('rebuild');
+
+        -- Для индекса без копии текста удаление требует старых значений колонок
+        CREATE TRIGGER trg_workouts_search_insert AFTER INSERT ON Workouts
+        BEGIN
+            INSERT INTO WorkoutsSearch (rowid, title, notes) VALUES (NEW.workout_id, NEW.title, NEW.notes);
+        END;
+
+        CREATE TRIGGER trg_workouts_search_delete AFTER DELETE ON Workouts
+        BEGIN
+            INSERT INTO WorkoutsSearch (WorkoutsSearch, rowid, title, notes) VALUES ('delete', OLD.workout_id, OLD.title, OLD.notes);
+        END;
+
+        CREATE TRIGGER trg_workouts_search_update AFTER UPDATE OF title, notes ON Workouts
+        BEGIN
+            INSERT INTO WorkoutsSearch (WorkoutsSearch, rowid, title, notes) VALUES ('delete', OLD.workout_id, OLD.title, OLD.notes);
+            INSERT INTO WorkoutsSearch (rowid, title, notes) VALUES (NEW.workout_id, NEW.title, NEW.notes);
+        END;
+
+        CREATE TRIGGER trg_exercises_search_insert AFTER INSERT ON Exercises
+        BEGIN
+            INSERT INTO ExercisesSearch (rowid, name, description) VALUES (NEW.exercise_id, NEW.name, NEW.description);
+        END;
+
+        CREATE TRIGGER trg_exercises_search_delete AFTER DELETE ON Exercises
+        BEGIN
+            INSERT INTO ExercisesSearch (ExercisesSearch, rowid, name, description) VALUES ('delete', OLD.exercise_id, OLD.name, OLD.description);
+        END;
+
+        CREATE TRIGGER trg_exercises_search_update AFTER UPDATE OF name, description ON Exercises
+        BEGIN
+            INSERT INTO ExercisesSearch (ExercisesSearch, rowid, name, description) VALUES ('delete', OLD.exercise_id, OLD.name, OLD.description);
+            INSERT INTO ExercisesSearch (rowid, name, description) VALUES (NEW.exercise_id, NEW.name, NEW.description);
+        END;
+
+        CREATE TRIGGER trg_progress_search_insert AFTER INSERT ON Progress
+        BEGIN
+            INSERT INTO ProgressSearch (rowid, notes) VALUES (NEW.progress_id, NEW.notes);
+        END;
+
+        CREATE TRIGGER trg_progress_search_delete AFTER DELETE ON Progress
+        BEGIN
+            INSERT INTO ProgressSearch (ProgressSearch, rowid, notes) VALUES ('delete', OLD.progress_id, OLD.notes);
+        END;
+
+        CREATE TRIGGER trg_progress_search_update AFTER UPDATE OF notes ON Progress
+        BEGIN
+            INSERT INTO ProgressSearch (ProgressSearch, rowid, notes) VALUES ('delete', OLD.progress_id, OLD.notes);
+            INSERT INTO ProgressSearch (rowid, notes) VALUES (NEW.progress_id, NEW.notes);
+        END;
+    '''),
+    (9, "Ключи идемпотентности для повторных POST", '''
+        -- Ответ на первый запрос с заголовком Idempotency-Key; повтор находит его по первичному ключу.
+        -- WITHOUT ROWID: строка хранится прямо в B-дереве ключа, без отдельного rowid
+        CREATE TABLE IdempotencyKeys (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            fingerprint BLOB NOT NULL,
+            response BLOB NOT NULL,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID;
+
+        -- Удаление просроченных ключей без полного просмотра
+        CREATE INDEX idx_idempotency_created ON IdempotencyKeys(created_at);
+    '''),
+    (10, "Удаление индекса, замененного агрегатами WorkoutTypeStats", '''
+        -- /stats/workouts читает WorkoutTypeStats (миграция 4), а индекс обновлялся при каждой записи в Workouts
+        DROP INDEX IF EXISTS idx_workouts_type_stats;
+    '''),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def split_statements(sql):
+    """Скрипт миграции -> отдельные выражения (тела триггеров не разрезаются)"""
+    statements = []
+    buffer = ""
+    for part in sql.split(";"):
+        buffer += part + ";"
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip(" \n;"):
+                statements.append(buffer)
+            buffer = ""
+    return statements
+
+
+def migrate(conn, target=SCHEMA_VERSION):
+    """Применить недостающие миграции, вернуть список примененных версий"""
+    current = get_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"Версия схемы базы ({current}) новее версии приложения ({SCHEMA_VERSION})")
+
+    # Миграции перестраивают таблицы со ссылками (DROP + RENAME), поэтому проверку
+    # внешних ключей на это время выключаем; внутри транзакции PRAGMA не действует
+    foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys = OFF")
+    applied = []
+    try:
+        for version, description, sql in MIGRATIONS:
+            if version <= current or version > target:
+                continue
+            # Версия перечитывается под блокировкой на запись: другой процесс, запущенный
+            # одновременно, мог уже применить эту миграцию. executescript завершает открытую
+            # транзакцию, поэтому выражения выполняются по одному в одной транзакции;
+            # при ошибке миграция откатывается целиком и user_version не меняется
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if get_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                for statement in split_statements(sql):
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            applied.append(version)
+    finally:
+        conn.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+    return applied
+
+
+if __name__ == "__main__":
+    conn = connect(DB_PATH)
+    try:
+        applied = migrate(conn)
+        for version, description, _ in MIGRATIONS:
+            if version in applied:
+                print(f"Применена миграция {version}: {description}")
+        print(f"Версия схемы: {get_version(conn)}")
+    finally:
+        conn.close()
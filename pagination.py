@@ -0,0 +1,64 @@
+import base64
+import json
+
+from serialization import FastJSONResponse
+
+# Размер страницы по умолчанию и верхняя граница для параметра limit
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Заголовок ответа с курсором следующей страницы (нет заголовка - страница последняя)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Направление сортировки -> сравнение с ключом последней строки предыдущей страницы
+SORT_DIRECTIONS = {"asc": ">", "desc": "<"}
+
+
+def encode_cursor(values):
+    """Упаковать ключ последней строки страницы в непрозрачную строку"""
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    """Распаковать курсор; ValueError, если он поврежден или не того формата"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Некорректный курсор")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Некорректный курсор")
+    # Значения курсора подставляются в SQL как параметры: списки и объекты sqlite3 не примет
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        raise ValueError("Некорректный курсор")
+    return values
+
+
+def keyset(sort, key, order, page_cursor):
+    """Продолжение списка, отсортированного по (sort, key): (условие или None, параметры, ORDER BY)
+
+    Курсор хранит значения sort и key последней строки; ValueError, если он поврежден.
+    """
+    order_by = f"{sort} {order.upper()}, {key} {order.upper()}"
+    if page_cursor is None:
+        return None, [], order_by
+    values = decode_cursor(page_cursor, 2)
+    return f"({sort}, {key}) {SORT_DIRECTIONS[order]} (?, ?)", values, order_by
+
+
+def split_page(rows, limit, key):
+    """Отрезать лишнюю строку и построить курсор следующей страницы
+
+    Запрос страницы выбирает limit + 1 строк: если лишняя строка пришла,
+    следующая страница существует и начинается после последней строки текущей.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
+
+
+def page_response(items, next_cursor):
+    """Ответ со страницей; курсор следующей страницы передается в заголовке"""
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return FastJSONResponse(content=items, headers=headers)
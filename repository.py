@@ -0,0 +1,219 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+from updates import compile_update
+
+# psycopg и psycopg_pool - необязательные зависимости: нужны только для PostgreSQL
+try:
+    import psycopg
+    from psycopg_pool import ConnectionPool as PostgresConnectionPool
+except ImportError:
+    psycopg = None
+    PostgresConnectionPool = None
+
+# Строка подключения к PostgreSQL и размеры его пула соединений
+POSTGRES_DSN = os.environ.get("FITNESS_PG_DSN")
+POSTGRES_POOL_MIN = int(os.environ.get("FITNESS_PG_POOL_MIN", "1"))
+POSTGRES_POOL_MAX = int(os.environ.get("FITNESS_PG_POOL_MAX", "16"))
+
+# Нарушение ограничений (внешний ключ, уникальность) на любом из бэкендов
+INTEGRITY_ERRORS = (sqlite3.IntegrityError,) if psycopg is None else (sqlite3.IntegrityError, psycopg.IntegrityError)
+
+
+def execute(conn, sql, params=()):
+    """Выполнить запрос с параметрами "?" на соединении sqlite3 или psycopg"""
+    if not isinstance(conn, sqlite3.Connection):
+        # В текстах запросов репозиториев "?" встречается только как параметр
+        sql = sql.replace("?", "%s")
+    return conn.execute(sql, params)
+
+
+class Repository:
+    """Запросы к одной таблице: одинаковый SQL для SQLite и PostgreSQL
+
+    Методы принимают открытое соединение и не фиксируют транзакцию:
+    коммит, сброс кэша и прочие последствия записи остаются в обработчике.
+    """
+
+    def __init__(self, table, key, columns):
+        self.table = table
+        self.key = key
+        self.columns = columns
+
+    def create(self, conn, **values):
+        """Вставить строку, вернуть ее ключ"""
+        columns = [column for column in self.columns if column in values]
+        cursor = execute(
+            conn,
+            f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) RETURNING {self.key}",
+            [values[column] for column in columns]
+        )
+        return cursor.fetchall()[0][0]
+
+    def get(self, conn, key_value):
+        """Строка по ключу или None"""
+        columns = (self.key, *self.columns)
+        rows = execute(conn, f"SELECT {', '.join(columns)} FROM {self.table} WHERE {self.key} = ?", (key_value,)).fetchall()
+        return dict(zip(columns, rows[0])) if rows else None
+
+    def update(self, conn, key_value, fields, returning=()):
+        """Частичное обновление одним UPDATE, без предварительного SELECT
+
+        Возвращает None, если строки с таким ключом нет, иначе словарь колонок
+        из returning (пустой, если returning не задан).
+        """
+        cursor = execute(conn, compile_update(self.table, self.key, tuple(fields), tuple(returning)), (*fields.values(), key_value))
+        if not returning:
+            return {} if cursor.rowcount else None
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        return dict(zip((column[0] for column in cursor.description), rows[0]))
+
+    def delete(self, conn, key_value, returning=()):
+        """Удалить строку по ключу; None, если ее не было, иначе словарь колонок из returning"""
+        sql = f"DELETE FROM {self.table} WHERE {self.key} = ?"
+        if returning:
+            sql += f" RETURNING {', '.join(returning)}"
+        cursor = execute(conn, sql, (key_value,))
+        if not returning:
+            return {} if cursor.rowcount else None
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        return dict(zip(returning, rows[0]))
+
+
+class WorkoutExerciseRepository(Repository):
+    """Упражнения в тренировках"""
+
+    def for_workout(self, conn, workout_id):
+        """Строки (workout_exercise_id, exercise_id, sets, reps, weight_kg, duration_seconds) тренировки"""
+        return execute(conn, '''
+            SELECT workout_exercise_id, exercise_id, sets, reps, weight_kg, duration_seconds
+            FROM WorkoutExercises
+            WHERE workout_id = ?
+        ''', (workout_id,)).fetchall()
+
+    def workouts_with_exercise(self, conn, exercise_id):
+        """id тренировок, в которые входит упражнение"""
+        rows = execute(conn, "SELECT DISTINCT workout_id FROM WorkoutExercises WHERE exercise_id = ?", (exercise_id,)).fetchall()
+        return [row[0] for row in rows]
+
+
+workout_repository = Repository(
+    "Workouts", "workout_id", ("title", "workout_type", "duration_minutes", "calories_burned", "date", "notes")
+)
+exercise_repository = Repository("Exercises", "exercise_id", ("name", "description", "muscle_group"))
+progress_repository = Repository(
+    "Progress", "progress_id", ("date", "weight", "height", "body_fat_percentage", "muscle_mass", "notes")
+)
+workout_exercise_repository = WorkoutExerciseRepository(
+    "WorkoutExercises", "workout_exercise_id", ("workout_id", "exercise_id", "sets", "reps", "weight_kg", "duration_seconds")
+)
+
+
+
+# Схема таблиц, с которыми работают репозитории и ключи идемпотентности, в PostgreSQL;
+# имена без кавычек, поэтому запросы подходят без изменений.
+# Агрегаты статистики, полнотекстовый поиск и пакетные операции остаются только в SQLite.
+POSTGRES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS Workouts (
+        workout_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        title TEXT NOT NULL,
+        workout_type TEXT NOT NULL,
+        duration_minutes INTEGER NOT NULL,
+        calories_burned INTEGER,
+        date DATE NOT NULL,
+        notes TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_workouts_date ON Workouts(date, workout_id);
+    CREATE INDEX IF NOT EXISTS idx_workouts_type_date ON Workouts(workout_type, date);
+
+    CREATE TABLE IF NOT EXISTS Exercises (
+        exercise_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        muscle_group TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS Progress (
+        progress_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        date DATE NOT NULL,
+        weight DOUBLE PRECISION,
+        height DOUBLE PRECISION,
+        body_fat_percentage DOUBLE PRECISION,
+        muscle_mass DOUBLE PRECISION,
+        notes TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_progress_date ON Progress(date, progress_id);
+
+    CREATE TABLE IF NOT EXISTS WorkoutExercises (
+        workout_exercise_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        workout_id BIGINT NOT NULL REFERENCES Workouts(workout_id) ON DELETE CASCADE,
+        exercise_id BIGINT NOT NULL REFERENCES Exercises(exercise_id) ON DELETE CASCADE,
+        sets INTEGER,
+        reps INTEGER,
+        weight_kg DOUBLE PRECISION,
+        duration_seconds INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_workout_exercises_workout ON WorkoutExercises(workout_id);
+    CREATE INDEX IF NOT EXISTS idx_workout_exercises_exercise ON WorkoutExercises(exercise_id);
+
+    CREATE TABLE IF NOT EXISTS IdempotencyKeys (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        fingerprint BYTEA NOT NULL,
+        response BYTEA NOT NULL,
+        created_at BIGINT NOT NULL,
+        PRIMARY KEY (scope, key)
+    );
+    CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON IdempotencyKeys(created_at);
+'''
+
+
+class PostgresBackend:
+    """PostgreSQL для тех же репозиториев: пул соединений psycopg, параллельные писатели
+
+    Выбирается настройкой FITNESS_DB_BACKEND=postgres (database.py) и повторяет интерфейс
+    database.ConnectionPool: connection() для чтения, writer() для записи, warm(), close().
+    В отличие от SQLite, у PostgreSQL нет одной блокировки записи на базу,
+    поэтому writer() выдает любое соединение пула, и записи идут одновременно.
+    """
+
+    def __init__(self, dsn=POSTGRES_DSN, min_size=POSTGRES_POOL_MIN, max_size=POSTGRES_POOL_MAX):
+        if psycopg is None:
+            raise RuntimeError("Для PostgreSQL нужны пакеты psycopg и psycopg_pool")
+        if not dsn:
+            raise RuntimeError("Не задана строка подключения FITNESS_PG_DSN")
+        # Кэш ответов и справочник упражнений разделяются по path, как для файлов SQLite
+        self.path = dsn
+        self.size = max_size
+        self.pool = PostgresConnectionPool(dsn, min_size=min_size, max_size=max_size, open=True)
+
+    def create_schema(self):
+        with self.connection() as conn:
+            conn.execute(POSTGRES_SCHEMA)
+            conn.commit()
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула; незавершенная транзакция откатывается при возврате"""
+        with self.pool.connection() as conn:
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+
+    def writer(self):
+        """Соединение для записи: коммит делает обработчик, остальное откатывается"""
+        return self.connection()
+
+    def warm(self):
+        """Дождаться минимального числа соединений и создать недостающие таблицы"""
+        self.pool.wait()
+        self.create_schema()
+
+    def close(self):
+        self.pool.close()
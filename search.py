@@ -0,0 +1,74 @@
+import itertools
+import re
+
+# Сколько результатов возвращать по умолчанию и максимум
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Сколько последних совпадений в каждой области ранжируется по bm25 по умолчанию.
+# Для редких слов это все совпадения; для слов, которые есть в сотнях тысяч строк,
+# полная сортировка по rank занимала бы сотни миллисекунд. Ценой этого более старая,
+# но более релевантная строка в выдачу не попадет - для полного ранжирования
+# search() вызывается с candidates=None (/search?exact=true)
+SEARCH_CANDIDATES = 200
+
+# Разметка найденных слов во фрагменте и длина фрагмента в словах
+HIGHLIGHT = ("<b>", "</b>")
+SNIPPET_ELLIPSIS = "…"
+SNIPPET_TOKENS = 12
+
+# Область поиска -> (таблица FTS5, исходная таблица, ключ, поля исходной строки в ответе)
+SEARCH_SCOPES = {
+    "workouts": ("WorkoutsSearch", "Workouts", "workout_id", ["title", "workout_type", "date"]),
+    "exercises": ("ExercisesSearch", "Exercises", "exercise_id", ["name", "muscle_group"]),
+    "progress": ("ProgressSearch", "Progress", "progress_id", ["date"]),
+}
+
+_WORD = re.compile(r"\w+")
+
+
+def build_match(query, prefix=True):
+    """Запрос пользователя -> выражение MATCH для FTS5
+
+    Каждое слово берется в кавычки, поэтому операторы и спецсимволы FTS5
+    из запроса не интерпретируются. Слова объединяются через AND;
+    последнее слово (или любое, оканчивающееся на *) ищется как префикс.
+    """
+    terms = [(m.group(), query[m.end():m.end() + 1] == "*") for m in _WORD.finditer(query)]
+    if not terms:
+        return None
+    if prefix:
+        terms[-1] = (terms[-1][0], True)
+    return " ".join(f'"{word}"' + ("*" if is_prefix else "") for word, is_prefix in terms)
+
+
+def search(conn, match, scopes, limit, candidates=SEARCH_CANDIDATES):
+    """Найти строки в областях и упорядочить по релевантности (bm25) внутри каждой области
+
+    candidates - сколько последних совпадений области ранжировать, None - все совпадения.
+    bm25 разных таблиц FTS5 считается по разной статистике и между собой не сравнивается,
+    поэтому области чередуются: лучшая строка каждой области, затем вторые и так далее.
+    """
+    # Кандидаты берутся в порядке rowid (от новых к старым) - это FTS5 делает без сортировки
+    candidate_order = "rank" if candidates is None else "rowid DESC"
+    per_scope = []
+    for scope in scopes:
+        fts, table, key, columns = SEARCH_SCOPES[scope]
+        # bm25 и фрагмент считаются только для кандидатов, строки исходной таблицы - только для выдачи
+        rows = conn.execute(f'''
+            SELECT found.rowid, found.rank, found.snippet, {', '.join(f't.{c}' for c in columns)}
+            FROM (
+                SELECT rowid, rank, snippet({fts}, -1, ?, ?, ?, ?) AS snippet
+                FROM {fts} WHERE {fts} MATCH ? ORDER BY {candidate_order} LIMIT ?
+            ) AS found
+            JOIN {table} t ON t.{key} = found.rowid
+            ORDER BY found.rank LIMIT ?
+        ''', (*HIGHLIGHT, SNIPPET_ELLIPSIS, SNIPPET_TOKENS, match, limit if candidates is None else candidates, limit)).fetchall()
+        items = []
+        for row in rows:
+            item = {"type": scope, key: row[0], "rank": row[1], "snippet": row[2]}
+            item.update(zip(columns, row[3:]))
+            items.append(item)
+        per_scope.append(items)
+    results = [item for group in itertools.zip_longest(*per_scope) for item in group if item is not None]
+    return results[:limit]
@@ -0,0 +1,24 @@
+from fastapi.responses import JSONResponse
+
+# orjson - необязательная зависимость: без нее ответы кодируются стандартным json, как в Starlette
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ, который кодируется через orjson, если он установлен
+
+    Обработчик, вернувший готовый ответ, а не dict/list, не проходит через
+    jsonable_encoder FastAPI: строки не обходятся второй раз перед кодированием.
+    """
+
+    def render(self, content):
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content)
+
+
+def rows_as_dicts(columns, rows):
+    """Строки sqlite3 -> список словарей с ключами columns"""
+    return [dict(zip(columns, row)) for row in rows]
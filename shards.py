@@ -0,0 +1,149 @@
+import asyncio
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from catalog import exercise_catalog
+from database import POOL_SIZE, ConnectionPool, connect, current_pool
+from migrations import migrate
+from serialization import FastJSONResponse
+
+# Каталог с базами пользователей; не задан - шардирование выключено и все работают с основной базой
+SHARD_DIR = os.environ.get("FITNESS_SHARD_DIR")
+# Сколько баз пользователей держать открытыми и сколько соединений чтения у каждой.
+# По умолчанию соединений столько же, сколько потоков чтения (database.POOL_SIZE): иначе
+# запросы одного пользователя занимали бы потоки чтения ожиданием соединения его базы.
+# Соединения открываются по мере надобности, так что у редко используемой базы их мало
+SHARD_MAX_OPEN = int(os.environ.get("FITNESS_SHARD_MAX_OPEN", "64"))
+SHARD_POOL_SIZE = int(os.environ.get("FITNESS_SHARD_POOL_SIZE", str(POOL_SIZE)))
+
+# Заголовок с идентификатором пользователя; без него запрос идет в основную базу
+USER_HEADER = b"x-user-id"
+USER_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class ShardRegistry:
+    """Открытые базы пользователей: у каждого пользователя свой файл и свой пул соединений
+
+    Данные пользователей не пересекаются, а у каждого файла своя блокировка записи,
+    поэтому записи разных пользователей не ждут друг друга. Открытых пулов не больше
+    max_open: давно не использованные закрываются (LRU) и открываются заново при обращении.
+    """
+
+    def __init__(self, directory, max_open=SHARD_MAX_OPEN, pool_size=SHARD_POOL_SIZE):
+        self.directory = directory
+        self.max_open = max_open
+        self.pool_size = pool_size
+        self._pools = OrderedDict()  # пользователь -> пул
+        # Блокировка реестра защищает только словари и берется в цикле событий (lookup),
+        # поэтому под ней не выполняется ничего долгого: миграция нового файла идет под
+        # блокировкой этого пользователя, а вытесненные пулы закрываются после ее снятия
+        self._lock = threading.Lock()
+        self._opening = {}  # пользователь -> блокировка открытия его базы
+        self.opened = 0
+        self.evicted = 0
+
+    def path(self, user_id):
+        return os.path.join(self.directory, f"user-{user_id}.db")
+
+    def _get(self, user_id):
+        pool = self._pools.get(user_id)
+        if pool is not None:
+            self._pools.move_to_end(user_id)
+        return pool
+
+    def lookup(self, user_id):
+        """Пул уже открытой базы пользователя или None"""
+        with self._lock:
+            return self._get(user_id)
+
+    def open(self, user_id):
+        """Пул базы пользователя; новая база создается и мигрирует до текущей схемы"""
+        with self._lock:
+            pool = self._get(user_id)
+            if pool is not None:
+                return pool
+            opening = self._opening.setdefault(user_id, threading.Lock())
+
+        evicted = []
+        with opening:
+            try:
+                # Пока ждали, базу мог открыть другой поток
+                with self._lock:
+                    pool = self._get(user_id)
+                if pool is not None:
+                    return pool
+
+                path = self.path(user_id)
+                conn = connect(path)
+                try:
+                    migrate(conn)
+                finally:
+                    conn.close()
+                pool = ConnectionPool(path, size=self.pool_size)
+
+                with self._lock:
+                    self._pools[user_id] = pool
+                    self.opened += 1
+                    while len(self._pools) > self.max_open:
+                        evicted.append(self._pools.popitem(last=False)[1])
+                    self.evicted += len(evicted)
+            finally:
+                with self._lock:
+                    if self._opening.get(user_id) is opening:
+                        del self._opening[user_id]
+
+        for old in evicted:
+            # Запрос, который еще держит вытесненный пул, доработает с ним:
+            # его соединения закроются сборщиком мусора после возврата
+            old.close()
+            exercise_catalog.forget(old.path)
+        return pool
+
+    def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def stats(self):
+        with self._lock:
+            return {"open": len(self._pools), "max_open": self.max_open, "opened": self.opened, "evicted": self.evicted}
+
+
+shard_registry = ShardRegistry(SHARD_DIR) if SHARD_DIR else None
+
+
+class ShardMiddleware:
+    """ASGI-middleware: направить запрос в базу пользователя из заголовка X-User-Id
+
+    Пул базы кладется в database.current_pool и через копию контекста попадает
+    в потоки базы; кэш ответов и справочник упражнений тоже разделяются по базам.
+    """
+
+    def __init__(self, app, registry=None):
+        self.app = app
+        self.registry = registry if registry is not None else shard_registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.registry is None:
+            return await self.app(scope, receive, send)
+
+        user_id = next((value.decode("latin-1") for name, value in scope["headers"] if name == USER_HEADER), None)
+        if user_id is None:
+            return await self.app(scope, receive, send)
+        if not USER_ID.fullmatch(user_id):
+            response = FastJSONResponse({"error": "Некорректный X-User-Id"}, status_code=400)
+            return await response(scope, receive, send)
+
+        pool = self.registry.lookup(user_id)
+        if pool is None:
+            # Создание и миграция файла - блокирующие операции, не выполняем их в цикле событий
+            pool = await asyncio.get_running_loop().run_in_executor(None, self.registry.open, user_id)
+        token = current_pool.set(pool)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_pool.reset(token)
@@ -0,0 +1,152 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from starlette.responses import Response
+
+from cache import response_cache
+from database import DB_PATH, _read, connect, current_pool, db_read_with
+from serialization import FastJSONResponse
+
+# Как часто обновлять снимок для аналитики (секунды); 0 - снимок выключен, статистика читается из основной базы
+SNAPSHOT_INTERVAL = float(os.environ.get("FITNESS_SNAPSHOT_INTERVAL", "0"))
+# Куда копировать базу: ":memory:" или путь к отдельному файлу
+SNAPSHOT_PATH = os.environ.get("FITNESS_SNAPSHOT_PATH", ":memory:")
+
+# Заголовок ответа: время (unix, секунды) данных снимка; устаревание = текущее время - значение
+SNAPSHOT_HEADER = "X-Snapshot-Time"
+
+# Ответы, которые строятся по снимку: после обновления снимка их кэш сбрасывается
+SNAPSHOT_TAGS = ("stats:workouts", "stats:progress", "stats:timeseries")
+
+snapshot_log = logging.getLogger("fitness.snapshot")
+
+
+class Snapshot:
+    """Копия базы на момент taken_at; соединение одно, запросы к нему идут по очереди"""
+
+    __slots__ = ("conn", "taken_at", "lock")
+
+    def __init__(self, conn, taken_at):
+        self.conn = conn
+        self.taken_at = taken_at
+        self.lock = threading.Lock()
+
+
+class SnapshotReplica:
+    """Снимок основной базы только для чтения, обновляемый раз в interval секунд
+
+    Снимок делается через backup API SQLite одним шагом: это одна читающая
+    транзакция, которая в режиме WAL не мешает писателю. Тяжелые запросы
+    аналитики идут к копии и не конкурируют с записью за основной файл.
+    Новый снимок подменяет старый целиком; запросы, начатые на старом, дорабатывают на нем.
+    """
+
+    def __init__(self, interval=SNAPSHOT_INTERVAL, path=SNAPSHOT_PATH, source=DB_PATH):
+        self.interval = interval
+        self.path = path
+        self.source = source
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.refreshes = 0
+        self.last_duration = 0.0
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def refresh(self):
+        """Сделать новый снимок и подменить им текущий"""
+        with self._refresh_lock:
+            taken_at = time.time()
+            # Свое соединение, а не из пула: копирование большой базы не должно занимать соединения запросов
+            source = connect(self.source)
+            try:
+                if self.path == ":memory:":
+                    target = sqlite3.connect(":memory:", check_same_thread=False)
+                    source.backup(target)
+                else:
+                    # Копия собирается рядом и подменяет файл снимка целиком
+                    tmp = self.path + ".tmp"
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    copy = sqlite3.connect(tmp)
+                    source.backup(copy)
+                    # Копия перенимает режим WAL; файлу только для чтения журнал не нужен
+                    copy.execute("PRAGMA journal_mode = DELETE")
+                    copy.close()
+                    os.replace(tmp, self.path)
+                    target = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            finally:
+                source.close()
+            self._snapshot = Snapshot(target, taken_at)
+            self.refreshes += 1
+            self.last_duration = time.time() - taken_at
+        response_cache.invalidate(*SNAPSHOT_TAGS)
+
+    def current(self):
+        """Текущий снимок; первый делается при первом обращении"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.refresh()
+            snapshot = self._snapshot
+        return snapshot
+
+    def start(self):
+        """Запустить фоновое обновление снимка"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                snapshot_log.exception("Не удалось обновить снимок базы")
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "enabled": self.enabled,
+            "interval_seconds": self.interval,
+            "path": self.path,
+            "refreshes": self.refreshes,
+            "last_refresh_seconds": round(self.last_duration, 6),
+            "age_seconds": None if snapshot is None else round(time.time() - snapshot.taken_at, 3),
+        }
+
+
+snapshot_replica = SnapshotReplica()
+
+
+def _read_snapshot(func, args, kwargs):
+    # Снимок есть только у основной базы: запросы к базе пользователя читают ее обычным путем
+    if not snapshot_replica.enabled or current_pool.get() is not None:
+        return _read(func, args, kwargs)
+
+    snapshot = snapshot_replica.current()
+    with snapshot.lock:
+        response = func(snapshot.conn, *args, **kwargs)
+    if not isinstance(response, Response):
+        response = FastJSONResponse(content=response)
+    # Время снимка, а не его возраст: заголовок остается верным и в закэшированном ответе
+    response.headers[SNAPSHOT_HEADER] = f"{snapshot.taken_at:.3f}"
+    return response
+
+
+def db_snapshot(func):
+    """Декоратор обработчика аналитики: func(conn, ...) читает снимок базы, если он включен"""
+    return db_read_with(_read_snapshot)(func)
@@ -0,0 +1,37 @@
+import functools
+import json
+
+# Сколько разных UPDATE (таблица + набор полей + RETURNING) держать скомпилированными
+UPDATE_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=UPDATE_CACHE_SIZE)
+def compile_update(table, key, fields, returning=()):
+    """Текст UPDATE для набора полей; один и тот же текст для одинаковых наборов,
+    поэтому подготовленное выражение берется из кэша выражений соединения"""
+    sql = f"UPDATE {table} SET {', '.join(f'{field} = ?' for field in fields)} WHERE {key} = ?"
+    if returning:
+        sql += f" RETURNING {', '.join(returning)}"
+    return sql
+
+
+def changed_fields(**values):
+    """Поля, переданные клиентом (None - поле не меняется)"""
+    return {name: value for name, value in values.items() if value is not None}
+
+
+def where_clause(key, ids, conditions):
+    """Условие пакетной операции: список id и условия [(sql, значение)], None - условие не задано
+
+    Список id передается одним параметром через json_each, а не отдельным ? на каждый id.
+    """
+    clauses = []
+    params = []
+    if ids is not None:
+        clauses.append(f"{key} IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(ids))
+    for sql, value in conditions:
+        if value is not None:
+            clauses.append(sql)
+            params.append(value)
+    return " AND ".join(clauses), params